@@ -1,7 +1,11 @@
 
 
 if __name__ == '__main__':
-    import os
+    import os,sys
+    #before anything else so imports and gtcfg setup are profiled too
+    if '--profile' in sys.argv:
+        import startup
+        startup.start()
     import argparse
     import logging
     from pprint import pprint as pp
@@ -13,8 +17,32 @@ if __name__ == '__main__':
     parser.add_argument('-pkg','--package', help='The package name you want to deploy.')
     group.add_argument('-rel','--release', help='The release type (major,minor,bug).', choices=['major','minor','bug'])
     group.add_argument('-ver','--version', help='The package version to publish.')
+    group.add_argument('--gc', action='store_true', help='Remove old rc builds of the package.')
+    group.add_argument('--refresh', action='store_true',
+                       help='Fetch and report branch/status of --package/--packages or every repo in GT_DEV_ROOT.')
     parser.add_argument('-prj','--project', help='The project to which to publish the package version.')
+    parser.add_argument('--packages', nargs='+', help='Batch mode: packages to run the release/version action on.')
+    parser.add_argument('--manifest', help='Batch mode: JSON list of {"package", "release"|"version", "project", "requires"}.')
+    parser.add_argument('--workers', type=int, help='Batch mode: packages processed concurrently (default 4), '
+                                                    'gc: parallel deletes, refresh: repos fetched at once (default 16).')
+    parser.add_argument('--timeout', type=float, default=60, help='refresh: seconds each git call may take.')
+    parser.add_argument('--catalog', choices=['latest','builds','tags','published','rebuild'],
+                        help='Query the release catalog, for --package/--packages or every package. '
+                             'rebuild rescans the roots (default every package in GT_BUILD_ROOT). '
+                             'Needs GT_CATALOG set to the database path.')
+    parser.add_argument('--plan', action='store_true',
+                        help='Report what --release (default minor) of --package/--packages would copy, publish '
+                             'and how long it should take, without changing anything. --debug lists the files.')
+    parser.add_argument('--keep', type=int, help='gc: builds to keep (default GT_GC_KEEP or 10).')
+    parser.add_argument('--max-age', type=float, help='gc: only remove builds older than this many days.')
+    parser.add_argument('--dry-run', action='store_true', help='gc: report what would be removed.')
+    parser.add_argument('--daemon', choices=['serve','status','reload','stop'],
+                        help='serve runs the deployer daemon (GT_DAEMON_ADDRESS), the others query or control it.')
+    parser.add_argument('--submit', action='store_true',
+                        help='Run the release/version action of --package/--packages/--manifest on the daemon.')
     parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print cProfile stats and import times at exit, stats file in GT_PROFILE_OUT or the temp dir.')
     
     args = parser.parse_args()
     action=None
@@ -52,7 +80,175 @@ if __name__ == '__main__':
         action="deploy_release"
         action_arg = args.release
     
-    if args.package and action and action_arg:
+    if args.daemon:
+        import daemon
+        import iosched
+        if args.daemon == 'serve':
+            daemon.serve(workers=args.workers)
+        else:
+            for event in daemon.request({'op': args.daemon}):
+                if event['event'] == 'status':
+                    print "daemon [{}] up {:.0f}s, {} workers, {} jobs finished, {} warm packages".format(
+                        event['pid'], event['uptime'], event['workers'], event['finished'], len(event['packages']))
+                    for job in event['running'] + event['pending']:
+                        print "  #{} [{}] {} {} {}".format(job['id'], job['package'], job['action'], job['arg'], job['status'])
+                    if event['io']['devices']:
+                        print iosched.format_stats(event['io'])
+                    if args.debug:
+                        pp(event)
+                else:
+                    print event['event']
+    
+    elif args.catalog:
+        import time
+        import pkg
+        import catalog
+        _catalog = catalog.Catalog()
+        names = args.packages or ([args.package] if args.package else None)
+        start = time.time()
+        if args.catalog == 'rebuild':
+            if not names:
+                root = os.environ["GT_BUILD_ROOT"]
+                names = sorted(n for n in os.listdir(root) if not n.startswith('.') and os.path.isdir(os.path.join(root, n)))
+            resolved = dict((p.name, p) for p in gtcfg.resolve.packages("default", packages=names, user=False) or [])
+            pkgs = [pkg.Pkg(**resolved[n].dump()) if n in resolved else pkg.Pkg(name=n) for n in names]
+            result = _catalog.rebuild(pkgs, workers=args.workers or 4)
+            print "Catalog [{}] rebuilt: {} packages, {} tags in {:.2f}s".format(
+                _catalog.path, result['packages'], result['tags'], result['seconds'])
+        else:
+            if args.catalog == 'published':
+                rows = _catalog.published(names)
+                columns = catalog.published_columns
+            elif args.catalog == 'tags':
+                rows = sum((_catalog.tags(name) for name in names or []), [])
+                columns = catalog.tag_columns
+            else:
+                rows = _catalog.latest('build' if args.catalog == 'builds' else 'version', names)
+                columns = catalog.tag_columns
+            print catalog.format_rows(rows, columns)
+            if args.debug:
+                print "{} rows in {:.1f}ms".format(len(rows), (time.time() - start) * 1000)
+    
+    elif args.refresh:
+        import pkg
+        import repos
+        names = args.packages or ([args.package] if args.package else None)
+        if not names:
+            root = os.environ["GT_DEV_ROOT"]
+            names = sorted(n for n in os.listdir(root) if os.path.isdir(os.path.join(root, n, '.git')))
+        pkgs = [pkg.RepoPkg(name=name, lazy=True) for name in names]
+        reports = repos.refresh(pkgs, workers=args.workers or 16, force=True, timeout=args.timeout)
+        print repos.format_report(reports)
+        sys.exit(any(report['status'] == 'failed' for report in reports))
+    
+    elif args.plan:
+        import pkg
+        import util
+        names = args.packages or ([args.package] if args.package else [])
+        if not names:
+            parser.error("--plan needs --package or --packages")
+        resolved = dict((p.name, p) for p in gtcfg.resolve.packages("default", packages=names, user=False) or [])
+        for name in names:
+            _Pkg = pkg.Pkg(**resolved[name].dump()) if name in resolved else pkg.Pkg(name=name)
+            plan = _Pkg.plan(args.release or 'minor', workers=args.workers)
+            estimate = plan['estimate'] or {'phases': {}}
+            print "====== [{}] plan {} ======\nbuild {} -> version {}, {} files scanned in {:.2f}s".format(
+                name, plan['release'], plan['build'], plan['version'], plan['phases']['build']['files'],
+                plan['scan_seconds'])
+            rows = [("phase", "files", "MB", "estimate")]
+            for phase in ('build', 'deploy', 'compile', 'manifest', 'pack', 'overhead'):
+                if phase in plan['phases'] or phase in estimate['phases']:
+                    data = plan['phases'].get(phase, {})
+                    seconds = estimate['phases'].get(phase)
+                    rows.append((phase, data.get('files', ''),
+                                 "{:.1f}".format(data['bytes'] / float(1 << 20)) if data else '',
+                                 "{:.1f}s".format(seconds) if seconds is not None else '?'))
+            print util.format_columns(rows)
+            if plan['estimate']:
+                print "estimated {:.1f}s from the last {} deploys".format(plan['estimate']['seconds'], plan['estimate']['runs'])
+            else:
+                print "no timed deploys to estimate from"
+            publish = plan['publish']
+            print "publish {} -> {}".format(publish['from'] or 'unpublished', publish['to']),
+            if 'added' in publish:
+                print "{}: {} added, {} changed, {} removed".format(
+                    "full copy" if publish['full'] else "delta", len(publish['added']),
+                    len(publish['changed']), len(publish['removed']))
+            else:
+                print
+            if args.debug:
+                for rel in plan['files']:
+                    print "  {}".format(rel)
+                pp(dict((key, value) for key, value in plan.items() if key != 'files'))
+    
+    elif args.submit:
+        import batch
+        import daemon
+        jobs = []
+        if args.manifest:
+            jobs = batch.load_manifest(args.manifest, project=project)
+        names = args.packages or ([args.package] if args.package else [])
+        if names and action:
+            key = 'release' if args.release else 'version'
+            jobs += [batch.Job(**{'package': name, key: action_arg, 'project': project}) for name in names]
+        if not jobs:
+            parser.error("--submit needs --manifest, or --package/--packages with --release or --version")
+        def progress(event):
+            line = daemon.format_event(event)
+            if line:
+                print line
+                sys.stdout.flush()
+        jobs = daemon.submit([job.entry for job in jobs], on_event=progress)
+        print batch.format_table(jobs)
+        sys.exit(any(job.status != 'ok' for job in jobs))
+    
+    elif args.manifest or args.packages:
+        import pkg
+        import batch
+        jobs = []
+        if args.manifest:
+            jobs = batch.load_manifest(args.manifest, project=project)
+        if args.packages and args.release:
+            jobs += [batch.Job(package=name, release=args.release, project=project) for name in args.packages]
+        elif args.packages and args.version:
+            jobs += [batch.Job(package=name, version=args.version, project=project) for name in args.packages]
+        batch.resolve(jobs, pkg.Pkg)
+        import iosched
+        #publishes share one config chain, written once per project at the end
+        cfg_batch = pkg.PkgCfgBatch()
+        scheduler = iosched.IOScheduler()
+        batch.run(jobs, workers=args.workers or 4, scheduler=scheduler, cfg_batch=cfg_batch)
+        try:
+            cfg_batch.commit()
+        except Exception as err:
+            #every publish of the batch is in the commit
+            for job in jobs:
+                if job.action == 'publish' and job.status == 'ok':
+                    job.result, job.status = err, 'failed'
+        print batch.format_table(jobs)
+        if args.debug:
+            pp(dict((job.package, job.result) for job in jobs))
+            print iosched.format_stats(scheduler.stats())
+        sys.exit(any(job.status != 'ok' for job in jobs))
+    
+    elif args.package and args.gc:
+        import pkg
+        _pkg_list = gtcfg.resolve.packages("default", packages=[args.package],user=False)
+        if not _pkg_list:
+            _Pkg = pkg.Pkg(name=args.package)
+        else:
+            _Pkg = pkg.Pkg(**_pkg_list[0].dump())
+        result = _Pkg.gc(keep=args.keep, max_age=args.max_age, dry_run=args.dry_run, workers=args.workers)
+        print "====== [{}] gc ======\n{} {} of {} builds, {:.1f} MB in {:.2f}s".format(
+            args.package, "Would remove" if args.dry_run else "Removed", len(result['removed']),
+            result['builds'], result['bytes'] / float(1 << 20), result['seconds'])
+        for path, err in sorted(result['failed'].items()):
+            print "Failed {} >> {}".format(path, err)
+        if args.debug:
+            pp(result)
+        sys.exit(bool(result['failed']))
+    
+    elif args.package and action and action_arg:
         import pkg
         _pkg_list = gtcfg.resolve.packages("default", packages=[args.package],user=False)
         if not _pkg_list:
@@ -75,4 +271,4 @@ if __name__ == '__main__':
         
 
     
-        
\ No newline at end of file
+        
\ No newline at end of file
@@ -0,0 +1,174 @@
+'''
+race-free tag allocation shared by processes and hosts on one filesystem
+'''
+import os
+import time
+import errno
+import random
+import socket
+import shutil
+import logging
+import contextlib
+
+import fileops
+
+LOG = logging.getLogger(__name__)
+
+alloc_dir = '.alloc'
+
+
+class AllocError(BaseException):
+    pass
+
+
+class Counter(object):
+    '''
+    last allocated value of a sequence, kept in <root>/.alloc/<name>.counter
+    updates are serialized with an atomic mkdir lock next to it, which also
+    works over NFS/SMB where flock/fcntl locks can't be trusted.
+    the files live in a sub dir so allocating never changes the root mtime
+    root=<directory the values are allocated in>
+    name=<sequence name, e.g. 'build' or 'version'>
+    timeout=<seconds to wait for the lock, default GT_ALLOC_TIMEOUT or 60>
+    stale=<age in seconds after which a lock is broken, default GT_ALLOC_STALE or 120>
+    '''
+    def __init__(self, root, name, timeout=None, stale=None):
+        self.root = root
+        self.name = name
+        self.path = os.path.join(root, alloc_dir, name + '.counter')
+        self.lock_path = os.path.join(root, alloc_dir, name + '.lock')
+        self.timeout = float(timeout or os.environ.get("GT_ALLOC_TIMEOUT", 60))
+        self.stale = float(stale or os.environ.get("GT_ALLOC_STALE", 120))
+        #value before the last reserve of this instance, see release
+        self.last = None
+
+    def _owner(self):
+        return "{}@{}".format(os.getpid(), socket.gethostname())
+
+    def _break_stale(self):
+        '''
+        remove the lock if its owner died on this host or it is older than stale
+        '''
+        try:
+            age = time.time() - os.path.getmtime(self.lock_path)
+        except OSError:
+            return
+        pid, host = 0, None
+        try:
+            with open(os.path.join(self.lock_path, 'owner')) as ofile:
+                owner, owner_host = ofile.read().strip().split('@', 1)
+            pid, host = int(owner), owner_host
+        except (IOError, ValueError):
+            #released meanwhile or the owner file is not written yet
+            pass
+        #os.kill(pid, 0) would terminate the process on windows
+        dead = host == socket.gethostname() and os.name != 'nt' and not fileops._pid_alive(pid)
+        if dead or age > self.stale:
+            LOG.warning("[alloc] breaking stale lock {} held by {}@{}".format(self.lock_path, pid, host))
+            #renamed first so only one waiter removes it
+            trash = "{}.stale-{}".format(self.lock_path, self._owner())
+            try:
+                os.rename(self.lock_path, trash)
+            except OSError:
+                return
+            shutil.rmtree(trash, ignore_errors=True)
+
+    @contextlib.contextmanager
+    def locked(self):
+        parent = os.path.dirname(self.lock_path)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+        start = time.time()
+        delay = 0.005
+        while True:
+            try:
+                os.mkdir(self.lock_path)
+                break
+            except OSError as err:
+                if err.errno != errno.EEXIST:
+                    raise
+            if time.time() - start > self.timeout:
+                raise AllocError("Timed out after {}s waiting for {}".format(self.timeout, self.lock_path))
+            self._break_stale()
+            time.sleep(delay * (1 + random.random()))
+            delay = min(delay * 2, 0.25)
+        try:
+            with open(os.path.join(self.lock_path, 'owner'), 'w') as ofile:
+                ofile.write(self._owner())
+            yield
+        finally:
+            #leave it alone if it was broken as stale and taken over meanwhile
+            try:
+                with open(os.path.join(self.lock_path, 'owner')) as ofile:
+                    ours = ofile.read().strip() == self._owner()
+            except IOError:
+                ours = False
+            if ours:
+                shutil.rmtree(self.lock_path, ignore_errors=True)
+
+    def read(self):
+        '''
+        last allocated value, None if nothing was allocated yet
+        '''
+        try:
+            with open(self.path) as cfile:
+                return cfile.read().strip() or None
+        except IOError:
+            return None
+
+    def peek(self, advance, seed, taken=None):
+        '''
+        the value reserve would allocate now, nothing is written
+        '''
+        last = self.read()
+        if last is None:
+            last = seed()
+        value = advance(last)
+        while taken and taken(value):
+            value = advance(value)
+        return value
+
+    def reserve(self, advance, seed, taken=None):
+        '''
+        allocate the value after the last one
+        advance=<callable(last value) -> next value>
+        seed=<callable returning the last value in use, only called when
+              there is no counter file yet, e.g. from a directory scan>
+        taken=<callable(value) -> True if value is already in use, skipped over
+               when the counter lags behind tags created without it>
+        '''
+        with self.locked():
+            last = self.read()
+            if last is None:
+                last = seed()
+            value = advance(last)
+            while taken and taken(value):
+                value = advance(value)
+            self._write(value)
+        self.last = last
+        LOG.debug("[alloc] {} {} -> {}".format(self.root, self.name, value))
+        return value
+
+    def release(self, value, last):
+        '''
+        undo the reserve that allocated value, only while nothing was
+        allocated after it
+        last=<the value before it, Counter.last after that reserve>
+        returns True if the counter was wound back
+        '''
+        with self.locked():
+            if self.read() != value:
+                return False
+            self._write(last)
+        LOG.debug("[alloc] {} {} released {}, back to {}".format(self.root, self.name, value, last))
+        return True
+
+    def _write(self, value):
+        tmp = "{}.tmp-{}".format(self.path, self._owner())
+        with open(tmp, 'w') as cfile:
+            cfile.write(value)
+        fileops.replace(tmp, self.path)
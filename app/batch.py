@@ -0,0 +1,165 @@
+'''
+run deploy/publish actions for many packages in one interpreter
+'''
+import time
+import logging
+import Queue
+from multiprocessing.pool import ThreadPool
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import iosched
+import util
+
+LOG = logging.getLogger(__name__)
+
+_actions = {'release': 'deploy_release', 'version': 'publish'}
+
+
+class BatchError(BaseException):
+    pass
+
+
+class Job(object):
+    '''
+    one package action in a batch
+    package=<package name>
+    release=<major|minor|bug> or version=<x.y.z>
+    project=<project code for publish>
+    requires=<package names in the batch that must finish first>
+    '''
+    def __init__(self, **kw):
+        self.entry = dict(kw)
+        self.package = kw.get('package')
+        self.project = kw.get('project') or 'default'
+        self.requires = list(kw.get('requires', []))
+        self.action = None
+        self.arg = None
+        for key, action in _actions.items():
+            if kw.get(key):
+                self.action = action
+                self.arg = kw[key]
+        if not self.package or not self.action:
+            raise BatchError("Invalid batch entry {}: needs package and release or version".format(kw))
+        self.pkg = None
+        self.status = 'pending'
+        self.result = None
+        self.seconds = 0.0
+
+    def run(self, scheduler=None, **kw):
+        '''
+        scheduler=<iosched.IOScheduler the action waits on for its roots>
+        '''
+        start = time.time()
+        try:
+            func = getattr(self.pkg, self.action)
+            if scheduler:
+                with scheduler.slot(self.action, iosched.job_roots(self.pkg, self.action)):
+                    self.result = func(self.arg, project_code=self.project, **kw)
+            else:
+                self.result = func(self.arg, project_code=self.project, **kw)
+            self.status = 'ok'
+        except BaseException as err:
+            LOG.exception("[{}] {} {} failed".format(self.package, self.action, self.arg))
+            self.result = err
+            self.status = 'failed'
+        self.seconds = time.time() - start
+        return self
+
+
+def load_manifest(path, project=None):
+    '''
+    JSON list of job entries, or {"packages": [...]}
+    '''
+    with open(path) as mfile:
+        data = json.load(mfile)
+    if isinstance(data, dict):
+        data = data.get('packages', [])
+    jobs = []
+    for entry in data:
+        entry = dict(entry)
+        entry.setdefault('project', project)
+        jobs.append(Job(**entry))
+    return jobs
+
+
+def resolve(jobs, pkg_class):
+    '''
+    build every job's package with a single gtcfg.resolve.packages call
+    '''
+    import gtcfg.resolve
+    names = sorted(set(job.package for job in jobs))
+    resolved = dict((p.name, p) for p in gtcfg.resolve.packages("default", packages=names, user=False) or [])
+    for job in jobs:
+        if job.package in resolved:
+            job.pkg = pkg_class(**resolved[job.package].dump())
+        else:
+            job.pkg = pkg_class(name=job.package)
+    return jobs
+
+
+def run(jobs, workers=4, scheduler=None, **kw):
+    '''
+    run jobs on a bounded thread pool, a job starts once every job of
+    the packages it requires and every earlier job of its own package
+    has finished; if one of those failed it is skipped. ready publishes
+    are started before builds.
+    scheduler=<iosched.IOScheduler capping jobs per filesystem, default a new one>
+    kw are passed to each action
+    '''
+    kw['scheduler'] = scheduler or iosched.IOScheduler()
+    names = set(job.package for job in jobs)
+    for job in jobs:
+        missing = set(job.requires) - names
+        if missing:
+            raise BatchError("[{}] requires {} which are not in the batch".format(job.package, sorted(missing)))
+
+    done = Queue.Queue()
+    pending = list(jobs)
+    running = 0
+    pool = ThreadPool(max(1, workers))
+    try:
+        while pending or running:
+            changed = True
+            while changed:
+                changed = False
+                for job in sorted(pending, key=lambda job: iosched.priorities.get(job.action, 1)):
+                    deps = [other for other in jobs[:jobs.index(job)] if other.package == job.package]
+                    deps += [other for other in jobs if other.package in job.requires and other.package != job.package]
+                    if any(other.status in ('failed', 'skipped') for other in deps):
+                        job.status = 'skipped'
+                    elif all(other.status == 'ok' for other in deps):
+                        job.status = 'running'
+                        running += 1
+                        pool.apply_async(job.run, kwds=kw, callback=done.put)
+                    else:
+                        continue
+                    pending.remove(job)
+                    changed = True
+            if not running:
+                if pending:
+                    raise BatchError("Dependency cycle between {}".format(sorted(j.package for j in pending)))
+                break
+            util.queue_get(done)
+            running -= 1
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return jobs
+
+
+def format_table(jobs):
+    rows = [("package", "action", "arg", "status", "seconds", "result")]
+    for job in jobs:
+        result = job.result
+        if isinstance(result, dict) and 'tag' in result:
+            result = result['tag'].get('name')
+        rows.append((job.package, job.action, job.arg, job.status,
+                     "{:.2f}".format(job.seconds), str(result if result is not None else '')))
+    return util.format_columns(rows)
@@ -0,0 +1,414 @@
+'''
+benchmarks for the deployer hot paths
+python bench.py [name ...]
+'''
+import os,sys
+import time
+import shutil
+import tempfile
+import subprocess
+from pprint import pprint as pp
+
+import imp
+import zipimport
+
+import gitcmd
+import fileops
+import pack
+import tags
+
+
+class _PopenCounter(object):
+    '''
+    count subprocess.Popen calls made inside the block
+    '''
+    def __enter__(self):
+        self.count = 0
+        self._popen = subprocess.Popen
+        counter = self
+        class CountingPopen(self._popen):
+            def __init__(self, *args, **kw):
+                counter.count += 1
+                super(CountingPopen, self).__init__(*args, **kw)
+        subprocess.Popen = CountingPopen
+        return self
+
+    def __exit__(self, *exc):
+        subprocess.Popen = self._popen
+
+
+def _make_tagged_repo(root, count):
+    '''
+    bare repo + clone with <count> annotated rc tags on one commit
+    '''
+    bare = os.path.join(root, 'remote.git')
+    clone = os.path.join(root, 'clone')
+    subprocess.check_call(['git', 'init', '-q', '--bare', bare])
+    stream = ["commit refs/heads/master",
+              "mark :1",
+              "committer bench <bench@localhost> 0 +0000",
+              "data 5", "bench",
+              "M 644 inline README",
+              "data 5", "bench", ""]
+    for i in range(count):
+        stream += ["tag rc{}".format(i+1),
+                   "from :1",
+                   "tagger bench <bench@localhost> 0 +0000",
+                   "data 0", ""]
+    proc = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=bare, stdin=subprocess.PIPE)
+    proc.communicate("\n".join(stream) + "\n")
+    subprocess.check_call(['git', 'clone', '-q', bare, clone])
+    return bare, clone
+
+
+def bench_tag_resolution(count=2000):
+    '''
+    per-tag `git rev-list` vs ls-remote peeled lines + persistent cat-file
+    '''
+    root = tempfile.mkdtemp(prefix='deployer_bench_')
+    try:
+        bare, clone = _make_tagged_repo(root, count)
+        results = {'tags': count}
+
+        with _PopenCounter() as counter:
+            start = time.time()
+            refs = gitcmd.Git(clone).ls_remote_tags(bare)
+            commits = {}
+            for name, (tag_id, peeled) in refs.items():
+                proc = subprocess.Popen("git rev-list -1 " + tag_id, cwd=clone, shell=True,
+                                        stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+                out, err = proc.communicate()
+                commits[name] = out.split("\n")[0]
+            results['per_tag'] = {'processes': counter.count, 'seconds': time.time() - start}
+
+        with _PopenCounter() as counter:
+            start = time.time()
+            git = gitcmd.Git(clone)
+            bulk = git.resolve_tag_commits(git.ls_remote_tags(bare))
+            results['bulk'] = {'processes': counter.count, 'seconds': time.time() - start}
+
+        if bulk != commits:
+            raise Exception("bulk resolution does not match per-tag rev-list")
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _make_tree(root, files, size=2048, per_dir=200):
+    payload = os.urandom(size)
+    for i in range(files):
+        directory = os.path.join(root, "d{:04d}".format(i // per_dir))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "f{:06d}.py".format(i)), 'wb') as fobj:
+            fobj.write(payload)
+
+
+def bench_deploy(files=20000):
+    '''
+    build -> deploy: shutil.copytree vs fileops.deploy_tree (linked and copied)
+    '''
+    root = tempfile.mkdtemp(prefix='deployer_bench_')
+    try:
+        build = os.path.join(root, 'build')
+        _make_tree(build, files)
+        results = {'files': files}
+
+        start = time.time()
+        shutil.copytree(build, os.path.join(root, 'copytree'))
+        results['copytree'] = time.time() - start
+
+        stats = fileops.deploy_tree(build, os.path.join(root, 'linked'), workers=1)
+        results['deploy_tree_linked'] = stats['seconds']
+
+        for workers in (1, 8):
+            stats = fileops.deploy_tree(build, os.path.join(root, 'copied{}'.format(workers)),
+                                        link=False, workers=workers)
+            results['deploy_tree_copied_{}_workers'.format(workers)] = stats['seconds']
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class _DictTag(object):
+    '''
+    tag record as it was before __slots__
+    '''
+    def __init__(self, name):
+        self.id = None
+        self.commit = None
+        self.name = name
+        self.notes = None
+        self.path = None
+        self.branch = None
+
+
+class _SlotTag(object):
+    __slots__ = ('id', 'commit', 'name', 'notes', 'path', 'branch')
+
+    def __init__(self, name):
+        self.id = self.commit = self.notes = self.path = self.branch = None
+        self.name = name
+
+
+def bench_tag_table(count=100000, queries=100):
+    '''
+    list of dict backed tags sorted by split strings + linear scans
+    vs TagTable: integer keys, slots and bisect
+    '''
+    import random
+    names = ["{}.{}.{}".format(i // 10000, (i // 100) % 100, i % 100) for i in range(count)]
+    random.shuffle(names)
+    patterns = ["{}.{}.*".format(random.randrange(count // 10000 or 1), random.randrange(100))
+                for i in range(queries)]
+    results = {'tags': count, 'queries': queries}
+
+    start = time.time()
+    old = sorted((_DictTag(name) for name in names), key=lambda t: [int(n) for n in t.name.split('.')])
+    results['list_build'] = time.time() - start
+    start = time.time()
+    for pattern in patterns:
+        matches = [t for t in old if t.name.startswith(pattern[:-1])]
+        matches[-1:]
+        [t for t in old if 2 <= int(t.name.split('.')[0]) < 3]
+    results['list_queries'] = time.time() - start
+    results['dict_tag_bytes'] = sys.getsizeof(old[0]) + sys.getsizeof(old[0].__dict__)
+
+    start = time.time()
+    table = tags.TagTable(_SlotTag(name) for name in names)
+    results['table_build'] = time.time() - start
+    start = time.time()
+    for pattern in patterns:
+        table.latest(pattern)
+        table.range('>=2.0,<3')
+    results['table_queries'] = time.time() - start
+    results['slot_tag_bytes'] = sys.getsizeof(table[0])
+    return results
+
+
+def _build_worker(args):
+    name, builds = args
+    import pkg
+    _pkg = pkg.Pkg(name=name)
+    return [_pkg.build_release()['tag']['name'] for i in range(builds)]
+
+
+def bench_concurrent_builds(processes=16, builds=4):
+    '''
+    stress the rc allocator: <processes> processes each run <builds>
+    build_release calls on one package at once, every rc must be unique
+    '''
+    import multiprocessing
+    root = tempfile.mkdtemp(prefix='deployer_bench_')
+    env = dict(os.environ)
+    try:
+        os.environ["GT_BUILD_ROOT"] = os.path.join(root, 'build')
+        os.environ["GT_DEV_ROOT"] = os.path.join(root, 'dev')
+        _make_tree(os.path.join(root, 'dev', 'benchpkg'), 50)
+
+        start = time.time()
+        pool = multiprocessing.Pool(processes)
+        try:
+            names = sum(pool.map(_build_worker, [('benchpkg', builds)] * processes), [])
+            pool.close()
+        finally:
+            pool.join()
+        on_disk = [n for n in os.listdir(os.path.join(root, 'build', 'benchpkg')) if not n.startswith('.')]
+        return {'processes': processes, 'builds': len(names), 'unique': len(set(names)),
+                'on_disk': len(on_disk), 'seconds': time.time() - start}
+    finally:
+        os.environ.clear()
+        os.environ.update(env)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_plan_scan(files=20000):
+    '''
+    listing the files a deploy would copy: the os.walk + getsize scan of
+    CopyEngine vs fileops.scan_tree, single threaded and on the pool
+    '''
+    root = tempfile.mkdtemp(prefix='deployer_bench_')
+    try:
+        src = os.path.join(root, 'src')
+        _make_tree(src, files)
+        results = {'files': files, 'scandir': bool(fileops.scandir)}
+        start = time.time()
+        dirs, found = fileops.CopyEngine()._scan(src, os.path.join(root, 'dst'), None)
+        results['walk'] = {'seconds': time.time() - start, 'files': len(found)}
+        for workers in (1, 8):
+            start = time.time()
+            found = fileops.scan_tree(src, workers=workers)
+            results['scan_tree_{}'.format(workers)] = {'seconds': time.time() - start, 'files': len(found)}
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_refresh(repos=60, latency=0.5):
+    '''
+    repos.refresh of <repos> clones whose upload-pack sleeps <latency>
+    seconds, standing in for a remote server: one at a time vs all at once
+    '''
+    import pkg
+    import repos as repos_mod
+    root = tempfile.mkdtemp(prefix='deployer_bench_')
+    env = dict(os.environ)
+    try:
+        bare, clone = _make_tagged_repo(root, 10)
+        os.environ["GT_DEV_ROOT"] = os.path.join(root, 'dev')
+        os.environ["GT_BUILD_ROOT"] = os.path.join(root, 'build')
+        os.environ["GT_REPO_SERVER"] = "file://"
+        os.environ["GT_REPO_ROOT"] = os.path.join(root, 'remotes')
+        names = ["pkg{:03d}".format(i) for i in range(repos)]
+        for name in names:
+            remote = os.path.join(root, 'remotes', name + '.git')
+            local = os.path.join(root, 'dev', name)
+            subprocess.check_call(['git', 'clone', '-q', '--bare', bare, remote])
+            subprocess.check_call(['git', 'clone', '-q', remote, local])
+            subprocess.check_call(['git', 'config', 'remote.origin.uploadpack',
+                                   'sleep {}; git-upload-pack'.format(latency)], cwd=local)
+        pkgs = [pkg.RepoPkg(name=name, lazy=True) for name in names]
+
+        results = {'repos': repos, 'latency': latency}
+        for workers in (1, repos):
+            start = time.time()
+            reports = repos_mod.refresh(pkgs, workers=workers, force=True, timeout=60)
+            results['workers_{}'.format(workers)] = {
+                'seconds': time.time() - start,
+                'failed': len([r for r in reports if r['status'] != 'ok'])}
+        return results
+    finally:
+        os.environ.clear()
+        os.environ.update(env)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_startup(runs=5, budget=None):
+    '''
+    wall time of a fresh interpreter importing pkg and running the cli
+    --help, best of <runs>. fails when either is over budget seconds
+    (default GT_STARTUP_BUDGET or 0.075, both measure about 0.045 on a
+    workstation, so one more eager heavy import goes over)
+    '''
+    budget = float(budget or os.environ.get("GT_STARTUP_BUDGET", 0.075))
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = {'import_pkg': [sys.executable, '-c', 'import pkg'],
+                'cli_help': [sys.executable, os.path.join(here, '__main__.py'), '--help']}
+    results = {'budget': budget}
+    with open(os.devnull, 'w') as devnull:
+        for label, command in sorted(commands.items()):
+            times = []
+            for i in range(runs):
+                start = time.time()
+                subprocess.check_call(command, cwd=here, stdout=devnull)
+                times.append(time.time() - start)
+            results[label] = min(times)
+    over = sorted(label for label in commands if results[label] > budget)
+    if over:
+        raise AssertionError("startup over the {}s budget: {}".format(
+            budget, ", ".join("{} {:.3f}s".format(label, results[label]) for label in over)))
+    return results
+
+
+class _LatencyImporter(object):
+    '''
+    PEP 302 finder/loader for one path entry that sleeps <latency> per
+    filesystem round trip, standing in for a high-latency network share.
+    loose trees pay a stat per probed suffix and an open per module,
+    archives pay one read of the central directory and an open per module.
+    '''
+    def __init__(self, entry, latency):
+        self.entry = entry
+        self.latency = latency
+        self.round_trips = 0
+        self.zip = None
+        self._found = {}
+        if entry.endswith('.zip'):
+            self._wait()
+            self.zip = zipimport.zipimporter(entry)
+
+    def _wait(self):
+        self.round_trips += 1
+        time.sleep(self.latency)
+
+    def _probe(self, fullname):
+        base = os.path.join(self.entry, *fullname.split('.'))
+        for suffix, mode, kind in [('/__init__.py', 'U', imp.PKG_DIRECTORY)] + imp.get_suffixes():
+            self._wait()
+            if os.path.isfile(base + suffix):
+                return base + suffix, kind
+        return None, None
+
+    def find_module(self, fullname, path=None):
+        if self.zip:
+            return self if self.zip.find_module(fullname.replace('.', '/')) else None
+        self._found[fullname] = self._probe(fullname)
+        return self if self._found[fullname][0] else None
+
+    def load_module(self, fullname):
+        self._wait()
+        if self.zip:
+            code = self.zip.get_code(fullname.replace('.', '/'))
+            is_pkg = self.zip.is_package(fullname.replace('.', '/'))
+            filename = self.entry
+        else:
+            filename, kind = self._found.pop(fullname)
+            with open(filename) as src:
+                code = compile(src.read(), filename, 'exec')
+            is_pkg = kind == imp.PKG_DIRECTORY
+        module = sys.modules.setdefault(fullname, imp.new_module(fullname))
+        module.__file__ = filename
+        module.__loader__ = self
+        if is_pkg:
+            module.__path__ = [self.entry]
+        exec(code, module.__dict__)
+        return module
+
+
+def bench_packed_import(modules=200, latency=0.002):
+    '''
+    import every module of a package from a loose tree vs a packed zip
+    on a simulated <latency> seconds per round trip share
+    '''
+    root = tempfile.mkdtemp(prefix='deployer_bench_')
+    try:
+        loose = os.path.join(root, '1.0.0')
+        os.makedirs(os.path.join(loose, 'benchpkg'))
+        open(os.path.join(loose, 'benchpkg', '__init__.py'), 'w').close()
+        for i in range(modules):
+            with open(os.path.join(loose, 'benchpkg', 'm{}.py'.format(i)), 'w') as mod:
+                mod.write("VALUE = {}\ndef func(x):\n    return x + VALUE\n".format(i))
+        archive = pack.archive_path(root, '1.0.0', 'zip')
+        pack.pack(loose, archive, 'zip')
+
+        results = {'modules': modules, 'latency': latency}
+        for label, entry in (('loose', loose), ('zip', archive)):
+            importer = _LatencyImporter(entry, latency)
+            sys.meta_path.insert(0, importer)
+            try:
+                start = time.time()
+                for i in range(modules):
+                    __import__('benchpkg.m{}'.format(i))
+                results[label] = {'seconds': time.time() - start, 'round_trips': importer.round_trips}
+            finally:
+                sys.meta_path.remove(importer)
+                for name in [n for n in sys.modules if n == 'benchpkg' or n.startswith('benchpkg.')]:
+                    del sys.modules[name]
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+BENCHMARKS = {'tag_resolution': bench_tag_resolution,
+              'deploy': bench_deploy,
+              'packed_import': bench_packed_import,
+              'concurrent_builds': bench_concurrent_builds,
+              'tag_table': bench_tag_table,
+              'refresh': bench_refresh,
+              'startup': bench_startup,
+              'plan_scan': bench_plan_scan}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        pp({name: BENCHMARKS[name]()})
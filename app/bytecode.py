@@ -0,0 +1,87 @@
+'''
+precompile deployed python sources so consumers never compile on import
+'''
+import os
+import time
+import logging
+import py_compile
+import multiprocessing
+
+import fileops
+
+LOG = logging.getLogger(__name__)
+
+
+def _cache_path(path):
+    '''
+    where the interpreter looks for the compiled path
+    '''
+    try:
+        from importlib.util import cache_from_source
+    except ImportError:
+        return path + ('c' if __debug__ else 'o')
+    return cache_from_source(path)
+
+
+def _compile_file(args):
+    '''
+    runs in the pool, returns (path, error message or None)
+    '''
+    path, display = args
+    #written aside and renamed over: an existing pyc may be hardlinked to a
+    #build, py_compile would rewrite it in place
+    target = _cache_path(path)
+    tmp = "{}.tmp-{}".format(target, os.getpid())
+    kw = {'doraise': True, 'dfile': display, 'cfile': tmp}
+    #hash based pycs (py3.7+) stay valid whatever the deployed mtimes are
+    mode = getattr(py_compile, 'PycInvalidationMode', None)
+    if mode:
+        kw['invalidation_mode'] = mode.CHECKED_HASH
+    try:
+        py_compile.compile(path, **kw)
+        fileops.replace(tmp, target)
+        return (path, None)
+    except py_compile.PyCompileError as err:
+        return (path, err.msg)
+    except Exception as err:
+        return (path, str(err))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def compile_tree(root, workers=None, display_root=None):
+    '''
+    compile every .py file under root on a process pool
+    workers=<processes, default GT_COMPILE_WORKERS or cpu count>
+    display_root=<path recorded in the code objects instead of root,
+                  e.g. the final location of a staging directory>
+    returns {'files', 'failed': {path: error}, 'seconds'}
+    '''
+    start = time.time()
+    sources = []
+    for directory, dirs, files in os.walk(root):
+        for name in files:
+            if name.endswith('.py'):
+                path = os.path.join(directory, name)
+                sources.append((path, os.path.join(display_root, os.path.relpath(path, root))
+                                if display_root else path))
+
+    workers = int(workers or os.environ.get("GT_COMPILE_WORKERS", 0) or multiprocessing.cpu_count())
+    if workers > 1 and len(sources) > 1:
+        pool = multiprocessing.Pool(min(workers, len(sources)))
+        try:
+            results = pool.map(_compile_file, sources, chunksize=max(1, len(sources) // (workers * 4)))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        results = [_compile_file(source) for source in sources]
+
+    failed = dict((os.path.relpath(path, root), error) for path, error in results if error)
+    for path, error in sorted(failed.items()):
+        LOG.warning("[compile] {} >> {}".format(path, error))
+    return {'files': len(sources), 'failed': failed, 'seconds': time.time() - start}
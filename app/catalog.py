@@ -0,0 +1,201 @@
+'''
+on-disk release catalog (sqlite) of every package's builds, versions and
+published projects, kept up to date by build_release, deploy_release,
+publish and gc so listings never have to scan the build/deploy roots
+'''
+import os
+import time
+import logging
+import sqlite3
+from multiprocessing.pool import ThreadPool
+
+import util
+
+LOG = logging.getLogger(__name__)
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS tags (
+    package TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    commit_id TEXT,
+    path TEXT,
+    date TEXT,
+    user TEXT,
+    bytes INTEGER,
+    PRIMARY KEY (package, kind, name)
+);
+CREATE INDEX IF NOT EXISTS tags_seq ON tags (kind, package, seq);
+CREATE TABLE IF NOT EXISTS published (
+    package TEXT NOT NULL,
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    date TEXT,
+    user TEXT,
+    PRIMARY KEY (package, project)
+);
+'''
+
+tag_columns = ('package', 'kind', 'name', 'commit_id', 'path', 'date', 'user', 'bytes')
+published_columns = ('package', 'project', 'version', 'date', 'user')
+
+
+class CatalogError(BaseException):
+    pass
+
+
+def default_path():
+    '''
+    GT_CATALOG, None when it is unset or 'off'
+    the catalog is opt-in: the build root is usually on NFS, where sqlite
+    locking can't be trusted, so there is no default next to it
+    '''
+    path = os.environ.get("GT_CATALOG")
+    if not path or path == 'off':
+        return None
+    return path
+
+
+def seq(kind, name):
+    '''
+    sortable integer of a tag name: rcNNN or x.y.z
+    '''
+    if kind == 'build':
+        return int(name.split('rc')[-1])
+    major, minor, bug = [int(n) for n in name.split('.')]
+    return (major << 40) | (minor << 20) | bug
+
+
+def tag_row(package, kind, log):
+    '''
+    catalog row for a build log
+    '''
+    tag = log.get('tag', log.get('RepoTag', {}))
+    stats = log.get('stats') or {}
+    size = stats.get('pack', {}).get('bytes') if 'pack' in stats else stats.get('bytes')
+    return (package, kind, tag['name'], seq(kind, tag['name']), tag.get('commit'), tag.get('path'),
+            log.get('date'), (log.get('user') or {}).get('login'), size)
+
+
+class Catalog(object):
+    '''
+    sqlite catalog, one short lived connection per call so it can be used
+    from batch threads and concurrent processes. sqlite locking is not
+    reliable on every network filesystem, point GT_CATALOG at a local or
+    NFSv4 path when several hosts deploy at once.
+    path=<database file, default default_path(), disabled without one>
+    '''
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        if not self.path:
+            raise CatalogError("Catalog disabled, set GT_CATALOG to a database path")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        #no-op on an existing catalog, recreates one that was deleted
+        conn.executescript(_schema)
+        return conn
+
+    def _execute(self, sql, params=(), many=False):
+        conn = self._connect()
+        try:
+            with conn:
+                if many:
+                    return conn.executemany(sql, params).rowcount
+                return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def record_tag(self, package, kind, log):
+        '''
+        add or update the build ('build') or version ('version') of a build log
+        '''
+        self._execute("INSERT OR REPLACE INTO tags VALUES (?,?,?,?,?,?,?,?,?)",
+                      [tag_row(package, kind, log)], many=True)
+
+    def remove_tags(self, package, kind, names):
+        self._execute("DELETE FROM tags WHERE package=? AND kind=? AND name=?",
+                      [(package, kind, name) for name in names], many=True)
+
+    def record_publish(self, package, project, version, user=None):
+        self._execute("INSERT OR REPLACE INTO published VALUES (?,?,?,?,?)",
+                      [(package, project, version, time.strftime("%y/%m/%d-%H:%M"), user)], many=True)
+
+    def latest(self, kind='version', packages=None):
+        '''
+        newest tag of kind for every package, or only packages
+        '''
+        sql = ("SELECT t.* FROM tags t JOIN "
+               "(SELECT package, MAX(seq) AS seq FROM tags WHERE kind=? GROUP BY package) m "
+               "ON t.package=m.package AND t.seq=m.seq WHERE t.kind=?")
+        params = [kind, kind]
+        if packages:
+            sql += " AND t.package IN ({})".format(",".join("?" * len(packages)))
+            params += list(packages)
+        return self._execute(sql + " ORDER BY t.package", params)
+
+    def tags(self, package, kind='version'):
+        '''
+        every tag of kind of package, oldest first
+        '''
+        return self._execute("SELECT * FROM tags WHERE package=? AND kind=? ORDER BY seq", (package, kind))
+
+    def published(self, packages=None):
+        '''
+        version published to each project
+        '''
+        sql = "SELECT * FROM published"
+        params = []
+        if packages:
+            sql += " WHERE package IN ({})".format(",".join("?" * len(packages)))
+            params = list(packages)
+        return self._execute(sql + " ORDER BY package, project", params)
+
+    def rebuild(self, pkgs, workers=8):
+        '''
+        replace the tags of pkgs with what is on disk, packages are scanned
+        in parallel and written in one transaction. published rows are
+        kept, they only exist in the package configs.
+        pkgs=<Pkg instances>
+        returns {'packages', 'tags', 'seconds'}
+        '''
+        start = time.time()
+
+        def scan(pkg):
+            rows = []
+            for kind, builds in (('build', True), ('version', False)):
+                index = pkg.tag_index(builds=builds)
+                for name, path in index.items():
+                    log = pkg._read_build_log(path)
+                    if not log:
+                        log = {'tag': {'name': name, 'path': path}}
+                    rows.append(tag_row(pkg.name, kind, log))
+            return pkg.name, rows
+
+        pool = ThreadPool(max(1, min(workers, len(pkgs))))
+        try:
+            results = pool.map(scan, pkgs)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        conn = self._connect()
+        try:
+            with conn:
+                for name, rows in results:
+                    conn.execute("DELETE FROM tags WHERE package=?", (name,))
+                    conn.executemany("INSERT OR REPLACE INTO tags VALUES (?,?,?,?,?,?,?,?,?)", rows)
+        finally:
+            conn.close()
+        return {'packages': len(results), 'tags': sum(len(rows) for name, rows in results),
+                'seconds': time.time() - start}
+
+
+def format_rows(rows, columns):
+    rows = [columns] + [tuple('' if row.get(col) is None else row.get(col) for col in columns) for row in rows]
+    return util.format_columns(rows)
@@ -0,0 +1,503 @@
+'''
+long running deployer that keeps resolved packages, their tag indexes and
+the pkg config chain warm between jobs. jobs are submitted over a local
+socket, queued on a worker pool with at most one job per package running
+at a time, and their timing spans are streamed back to the submitter.
+
+the protocol is one JSON request line, answered by JSON event lines:
+  {"op": "submit", "jobs": [<batch entries>], "wait": true}
+      -> queued, start, span..., done per job, then end with every job
+  {"op": "status"} | {"op": "reload"} | {"op": "stop"} | {"op": "ping"}
+GT_DAEMON_ADDRESS=<unix socket path, or host:port for TCP. default
+                   deployer-<user>.sock in the temp dir, 127.0.0.1:7439
+                   where there are no unix sockets>
+GT_DAEMON_TOKEN_FILE=<where a TCP daemon writes the token every request
+                      must carry, readable by its user only. default
+                      .deployer-daemon.token in the home dir>
+the unix socket is only accessible to the user running the daemon
+GT_DAEMON_WORKERS=<jobs run at once, default 4>
+GT_DAEMON_CFG_TTL=<seconds the pkg config chain is reused, default 300>
+heavy I/O is capped per filesystem, see iosched
+'''
+import os
+import re
+import hmac
+import time
+import errno
+import binascii
+import socket
+import logging
+import tempfile
+import threading
+import itertools
+import SocketServer
+import Queue
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import batch
+import timing
+import iosched
+import util
+
+LOG = logging.getLogger(__name__)
+
+_tcp_regx = re.compile(r"^([\w.-]*):(\d+)$")
+
+
+class DaemonError(BaseException):
+    pass
+
+
+def default_address():
+    address = os.environ.get("GT_DAEMON_ADDRESS")
+    if address:
+        return address
+    if not hasattr(socket, 'AF_UNIX'):
+        return "127.0.0.1:7439"
+    user = os.environ.get("USERNAME", os.environ.get("USER", "deployer"))
+    return os.path.join(tempfile.gettempdir(), "deployer-{}.sock".format(user))
+
+
+def token_path():
+    return os.environ.get("GT_DAEMON_TOKEN_FILE") or os.path.join(os.path.expanduser("~"), ".deployer-daemon.token")
+
+
+def _write_token():
+    '''
+    new random token in token_path(), created readable by this user only
+    '''
+    token = binascii.hexlify(os.urandom(16))
+    path = token_path()
+    tmp = "{}.tmp-{}".format(path, os.getpid())
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as tfile:
+        tfile.write(token)
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+    return token
+
+
+def _read_token():
+    try:
+        with open(token_path()) as tfile:
+            return tfile.read().strip()
+    except IOError:
+        return None
+
+
+def _parse_address(address):
+    '''
+    (family, address) of a socket path or host:port
+    '''
+    match = _tcp_regx.match(address)
+    if match:
+        return socket.AF_INET, (match.group(1) or "127.0.0.1", int(match.group(2)))
+    if not hasattr(socket, 'AF_UNIX'):
+        raise DaemonError("Unix sockets are not available here, use host:port for [{}]".format(address))
+    return socket.AF_UNIX, address
+
+
+def _dumps(data):
+    return json.dumps(data, default=str) + "\n"
+
+
+class _Job(batch.Job):
+    '''
+    batch.Job with the id it was submitted as
+    '''
+    def __init__(self, id, **entry):
+        super(_Job, self).__init__(**entry)
+        self.id = id
+
+    def dump(self):
+        result = self.result
+        error = None
+        if isinstance(result, BaseException):
+            result, error = None, " ".join(str(result).split()) or type(result).__name__
+        return {'id': self.id, 'entry': self.entry, 'package': self.package, 'action': self.action,
+                'arg': self.arg, 'status': self.status, 'seconds': self.seconds,
+                'result': result, 'error': error}
+
+
+class Daemon(object):
+    '''
+    the queue, workers and warm state, independent of the socket server
+    workers=<jobs run at once, default GT_DAEMON_WORKERS or 4>
+    pkg_class=<package class jobs are resolved to, default pkg.Pkg>
+    '''
+    def __init__(self, workers=None, pkg_class=None):
+        if pkg_class is None:
+            import pkg
+            pkg_class = pkg.Pkg
+        self.pkg_class = pkg_class
+        self.workers = max(1, int(workers or os.environ.get("GT_DAEMON_WORKERS", 4)))
+        self.cfg_ttl = float(os.environ.get("GT_DAEMON_CFG_TTL", 300))
+        self.started = time.time()
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._pending = []
+        self._running = {}
+        self._finished = 0
+        self._pkgs = {}
+        self._cfg = None
+        self._cfg_loaded = 0
+        self._watchers = {}
+        self._stopped = False
+        self._threads = []
+        self.io = iosched.IOScheduler()
+
+    def start(self):
+        timing.subscribe(self._on_span)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name="deployer-worker-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        '''
+        stop taking jobs, pending ones are cancelled, running ones finish
+        '''
+        with self._cond:
+            self._stopped = True
+            for job in self._pending:
+                job.status = 'cancelled'
+                self._notify(job, {'event': 'done', 'job': job.dump()})
+            self._pending = []
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        timing.unsubscribe(self._on_span)
+
+    def _notify(self, job, event):
+        watcher = self._watchers.get(job.id)
+        if watcher:
+            watcher.put(event)
+
+    def _on_span(self, event):
+        job_id = event.get('job')
+        if job_id is not None:
+            event = dict(event)
+            event['event'] = 'span'
+            watcher = self._watchers.get(job_id)
+            if watcher:
+                watcher.put(event)
+
+    def _resolve(self, jobs):
+        '''
+        give every job the warm Pkg of its package, new packages are
+        resolved with one gtcfg call
+        '''
+        with self._cond:
+            cold = [job for job in jobs if job.package not in self._pkgs]
+        if cold:
+            batch.resolve(cold, self.pkg_class)
+        with self._cond:
+            for job in cold:
+                self._pkgs.setdefault(job.package, job.pkg)
+            for job in jobs:
+                job.pkg = self._pkgs[job.package]
+
+    def cfg_batch(self):
+        '''
+        shared PkgCfgBatch, reloaded when older than cfg_ttl and no
+        publish is running. a stale one only serves lookups, its commit
+        replays the upserts onto a fresh chain. each publish job collects
+        and commits its own upserts through a scope of it
+        '''
+        with self._cond:
+            publishing = any(job.action == 'publish' for job in self._running.values())
+            if self._cfg is None or (not publishing and time.time() - self._cfg_loaded > self.cfg_ttl):
+                import pkg
+                self._cfg = pkg.PkgCfgBatch()
+                self._cfg_loaded = time.time()
+            return self._cfg
+
+    def reload(self):
+        '''
+        drop the warm packages and config chain, they are resolved again on use
+        '''
+        with self._cond:
+            self._pkgs = {}
+            self._cfg = None
+
+    def submit(self, entries, watcher=None):
+        '''
+        queue batch entries, see batch.Job. requires only refers to
+        packages of the same submission.
+        watcher=<Queue.Queue the job events are put on>
+        returns the jobs
+        '''
+        with self._cond:
+            if self._stopped:
+                raise DaemonError("Daemon is stopping")
+            jobs = [_Job(next(self._ids), **dict(entry)) for entry in entries]
+        names = set(job.package for job in jobs)
+        for job in jobs:
+            missing = set(job.requires) - names
+            if missing:
+                raise batch.BatchError("[{}] requires {} which are not in the submission".format(
+                    job.package, sorted(missing)))
+        self._resolve(jobs)
+        with self._cond:
+            for job in jobs:
+                job.batch = jobs
+                if watcher:
+                    self._watchers[job.id] = watcher
+                self._pending.append(job)
+                self._notify(job, {'event': 'queued', 'job': job.id, 'package': job.package,
+                                   'position': len(self._pending) + len(self._running)})
+            self._cond.notify_all()
+        return jobs
+
+    def _next(self):
+        '''
+        first pending job whose package is idle and whose requires are done,
+        publishes first. jobs behind a failed requirement are skipped.
+        called with the lock held
+        '''
+        busy = set(job.package for job in self._running.values())
+        ready = None
+        for job in list(self._pending):
+            deps = [other for other in job.batch if other.package in job.requires and other.package != job.package]
+            if any(other.status in ('failed', 'skipped', 'cancelled') for other in deps):
+                job.status = 'skipped'
+                self._pending.remove(job)
+                self._finish(job)
+                continue
+            if job.package in busy or not all(other.status == 'ok' for other in deps):
+                #later jobs of a busy package wait too, they run in submission order
+                busy.add(job.package)
+                continue
+            busy.add(job.package)
+            if ready is None or iosched.priorities.get(job.action, 1) < iosched.priorities.get(ready.action, 1):
+                ready = job
+        if ready:
+            self._pending.remove(ready)
+        return ready
+
+    def _finish(self, job):
+        self._finished += 1
+        self._notify(job, {'event': 'done', 'job': job.dump()})
+        self._watchers.pop(job.id, None)
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._stopped:
+                    job = self._next()
+                    if job:
+                        break
+                    self._cond.wait(1)
+                if not job:
+                    return
+                kw = {}
+                if job.action == 'publish':
+                    kw['cfg_batch'] = self.cfg_batch().scope()
+                job.status = 'running'
+                self._running[job.id] = job
+                self._notify(job, {'event': 'start', 'job': job.id, 'package': job.package})
+            with timing.span('job', job=job.id, package=job.package):
+                job.run(scheduler=self.io, **kw)
+            if 'cfg_batch' in kw:
+                try:
+                    kw['cfg_batch'].commit()
+                except Exception as err:
+                    LOG.exception("[{}] config commit failed".format(job.package))
+                    job.result, job.status = err, 'failed'
+            with self._cond:
+                del self._running[job.id]
+                self._finish(job)
+                self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {'event': 'status', 'pid': os.getpid(), 'uptime': time.time() - self.started,
+                    'workers': self.workers, 'finished': self._finished,
+                    'running': [job.dump() for job in self._running.values()],
+                    'pending': [job.dump() for job in self._pending],
+                    'packages': sorted(self._pkgs), 'io': self.io.stats()}
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def _send(self, event):
+        self.wfile.write(_dumps(event))
+
+    def handle(self):
+        daemon = self.server.deployer
+        try:
+            request = json.loads(self.rfile.readline() or 'null') or {}
+            op = request.get('op')
+            if self.server.token and not hmac.compare_digest(
+                    unicode(request.get('token') or '').encode('utf-8'), self.server.token):
+                self._send({'event': 'error', 'error': "Not authorized, the token in [{}] is required".format(
+                    token_path())})
+            elif op == 'submit':
+                self._submit(daemon, request)
+            elif op == 'status':
+                self._send(daemon.status())
+            elif op == 'reload':
+                daemon.reload()
+                self._send({'event': 'reloaded'})
+            elif op == 'ping':
+                self._send({'event': 'pong', 'pid': os.getpid()})
+            elif op == 'stop':
+                self._send({'event': 'stopping'})
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                self._send({'event': 'error', 'error': "Unknown op [{}]".format(op)})
+        except socket.error as err:
+            LOG.debug("client went away >> {}".format(err))
+        except BaseException as err:
+            LOG.exception("request failed")
+            try:
+                self._send({'event': 'error', 'error': " ".join(str(err).split())})
+            except socket.error:
+                pass
+
+    def _submit(self, daemon, request):
+        watcher = Queue.Queue()
+        jobs = daemon.submit(request.get('jobs') or [], watcher)
+        if not request.get('wait', True):
+            self._send({'event': 'end', 'jobs': [job.dump() for job in jobs]})
+            return
+        waiting = set(job.id for job in jobs)
+        while waiting:
+            event = util.queue_get(watcher)
+            if event['event'] == 'done':
+                waiting.discard(event['job']['id'])
+            self._send(event)
+        self._send({'event': 'end', 'jobs': [job.dump() for job in jobs]})
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+        daemon_threads = True
+
+
+def serve(address=None, workers=None):
+    '''
+    run the daemon until a stop request or ctrl-c
+    a stale unix socket of a daemon that is gone is replaced
+    '''
+    address = address or default_address()
+    family, addr = _parse_address(address)
+    if family == socket.AF_INET:
+        #any local user can connect to a port, requests must prove they can read the token
+        server = _TCPServer(addr, _Handler)
+        server.token = _write_token()
+    else:
+        if os.path.exists(addr):
+            try:
+                list(request({'op': 'ping'}, address, timeout=5))
+            except DaemonError:
+                os.remove(addr)
+            else:
+                raise DaemonError("A daemon is already running on [{}]".format(address))
+        #created without group/other access, a chmod after bind leaves a window
+        umask = os.umask(0o177)
+        try:
+            server = _UnixServer(addr, _Handler)
+        finally:
+            os.umask(umask)
+        server.token = None
+    server.deployer = Daemon(workers=workers).start()
+    LOG.info("deployer daemon [{}] on [{}] with {} workers".format(os.getpid(), address, server.deployer.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.deployer.stop()
+        if family != socket.AF_INET and os.path.exists(addr):
+            os.remove(addr)
+        if server.token and _read_token() == server.token:
+            os.remove(token_path())
+
+
+def request(payload, address=None, timeout=None):
+    '''
+    send one request, yields the events it is answered with
+    timeout=<seconds to wait for the daemon to connect or answer, default none once connected>
+    '''
+    address = address or default_address()
+    family, addr = _parse_address(address)
+    if family == socket.AF_INET:
+        payload = dict(payload, token=_read_token())
+    conn = socket.socket(family, socket.SOCK_STREAM)
+    conn.settimeout(timeout or 10)
+    try:
+        conn.connect(addr)
+    except socket.error as err:
+        conn.close()
+        if err.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            raise DaemonError("No deployer daemon on [{}], start one with --daemon serve".format(address))
+        raise DaemonError("[{}] >> {}".format(address, err))
+    conn.settimeout(timeout)
+    try:
+        conn.sendall(_dumps(payload))
+        rfile = conn.makefile('r')
+        for line in rfile:
+            event = json.loads(line)
+            if event.get('event') == 'error':
+                raise DaemonError("[{}] >> {}".format(address, event['error']))
+            yield event
+    except socket.timeout:
+        raise DaemonError("[{}] did not answer within {}s".format(address, timeout))
+    finally:
+        conn.close()
+
+
+def submit(entries, address=None, on_event=None, wait=True):
+    '''
+    run batch entries on the daemon
+    on_event=<callable given every event as it arrives>
+    returns batch.Job instances with the status, seconds and result of each job
+    '''
+    final = []
+    for event in request({'op': 'submit', 'jobs': entries, 'wait': wait}, address):
+        if on_event:
+            on_event(event)
+        if event['event'] == 'end':
+            final = event['jobs']
+    jobs = []
+    for data in final:
+        job = batch.Job(**data['entry'])
+        job.status = data['status']
+        job.seconds = data['seconds']
+        job.result = data['error'] if data['error'] else data['result']
+        jobs.append(job)
+    return jobs
+
+
+def format_event(event):
+    '''
+    one line progress of a submit event, None for ones not worth printing
+    '''
+    kind = event['event']
+    if kind == 'queued':
+        return "[{}] queued #{} at {}".format(event['package'], event['job'], event['position'])
+    if kind == 'start':
+        return "[{}] started #{}".format(event['package'], event['job'])
+    if kind == 'span' and event['path'].count('/') <= 2:
+        return "[{}] {} {:.2f}s".format(event.get('package'), event['path'], event['seconds'])
+    if kind == 'done':
+        job = event['job']
+        return "[{}] {} #{} in {:.2f}s{}".format(job['package'], job['status'], job['id'], job['seconds'],
+                                                 " >> {}".format(job['error']) if job['error'] else "")
+    return None
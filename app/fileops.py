@@ -0,0 +1,629 @@
+import os
+import time
+import stat
+import errno
+import Queue
+import shutil
+import socket
+import hashlib
+import logging
+import threading
+from multiprocessing.pool import ThreadPool
+
+import util
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+LOG = logging.getLogger(__name__)
+
+#link failures that mean "copy instead"
+_link_fallback = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP)
+
+_block_size = 1 << 20
+
+
+def file_hash(path, block_size=_block_size):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as src:
+        for block in iter(lambda: src.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def same_file(path, other, compare='stat'):
+    '''
+    compare='stat' matches size + mtime, compare='hash' matches content
+    '''
+    try:
+        src_stat = os.stat(path)
+        other_stat = os.stat(other)
+    except OSError:
+        return False
+    if src_stat.st_size != other_stat.st_size:
+        return False
+    if compare == 'hash':
+        return file_hash(path) == file_hash(other)
+    return abs(src_stat.st_mtime - other_stat.st_mtime) < 0.001
+
+
+def ignore_names(top, names):
+    '''
+    shutil.copytree style ignore callable skipping names directly under top
+    '''
+    top = os.path.normpath(top)
+    names = list(names)
+    return lambda directory, contents: names if os.path.normpath(directory) == top else []
+
+
+def replace(src, dst):
+    '''
+    rename src over dst, atomic on posix (os.rename cannot overwrite on windows)
+    '''
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+        return
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def pmap(func, items, workers=None):
+    '''
+    func of every item on a bounded thread pool, results in completion order.
+    runs inline when there is nothing to overlap
+    workers=<pool size, default GT_COPY_WORKERS or 8>
+    '''
+    workers = max(1, int(workers or os.environ.get("GT_COPY_WORKERS", 8)))
+    if workers == 1 or len(items) < 2:
+        for item in items:
+            yield func(item)
+        return
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        for result in pool.imap_unordered(func, items):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _tmp_path(dst):
+    return os.path.join(os.path.dirname(dst), ".{}.tmp{}.{}".format(os.path.basename(dst), os.getpid(),
+                                                                   threading.current_thread().ident))
+
+
+def fast_copy(src, dst, atomic=True):
+    '''
+    copy src to dst, atomic=True writes a temp file next to dst and renames it over
+    '''
+    target = _tmp_path(dst) if atomic else dst
+    try:
+        with open(src, 'rb') as fsrc:
+            with open(target, 'wb') as fdst:
+                shutil.copyfileobj(fsrc, fdst, _block_size)
+        shutil.copystat(src, target)
+        if atomic:
+            replace(target, dst)
+    finally:
+        if atomic and os.path.exists(target):
+            os.remove(target)
+
+
+def link(src, dst, atomic=True):
+    '''
+    hardlink src to dst, atomic=True swaps it over an existing dst
+    returns False if the link is not possible (e.g. across filesystems)
+    '''
+    target = _tmp_path(dst) if atomic else dst
+    try:
+        os.link(src, target)
+    except OSError as err:
+        if err.errno not in _link_fallback:
+            raise
+        return False
+    if atomic:
+        replace(target, dst)
+    return True
+
+
+def same_device(src, dst):
+    '''
+    True when src and dst (or its nearest existing parent) share a filesystem
+    '''
+    while dst and not os.path.exists(dst):
+        parent = os.path.dirname(dst)
+        if parent == dst:
+            break
+        dst = parent
+    try:
+        return os.stat(src).st_dev == os.stat(dst).st_dev
+    except OSError:
+        return False
+
+
+def prune_tree(root, keep):
+    '''
+    remove files and directories under root whose path is not in keep
+    '''
+    for directory, dirs, files in os.walk(root, topdown=False):
+        for name in files:
+            path = os.path.join(directory, name)
+            if path not in keep:
+                os.remove(path)
+        if directory not in keep:
+            os.rmdir(directory)
+
+
+staging_prefix = '.staging-'
+trash_prefix = '.trash-'
+
+
+def _sibling(target, prefix):
+    return os.path.join(os.path.dirname(target), "{}{}-{}@{}".format(prefix, os.path.basename(target),
+                                                                    os.getpid(), socket.gethostname()))
+
+
+def staging_path(target):
+    '''
+    hidden directory next to target to build it in before swap_in
+    '''
+    return _sibling(target, staging_prefix)
+
+
+def trash_path(target):
+    '''
+    hidden name next to target to rename it to before deleting it
+    '''
+    return _sibling(target, trash_prefix)
+
+
+def swap_in(staging, target):
+    '''
+    publish staging at target with a rename
+    an existing target is renamed aside first and removed afterwards
+    '''
+    if not os.path.exists(target):
+        os.rename(staging, target)
+        return
+    trash = trash_path(target)
+    os.rename(target, trash)
+    try:
+        os.rename(staging, target)
+    except OSError:
+        os.rename(trash, target)
+        raise
+    if os.path.isdir(trash):
+        shutil.rmtree(trash, ignore_errors=True)
+    else:
+        os.remove(trash)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+
+def clean_staging(root, names, max_age=None):
+    '''
+    remove staging/trash entries left in root by interrupted runs
+    an entry is stale when its process on this host is gone or it is older
+    than max_age seconds (default GT_STAGING_MAX_AGE or 6 hours)
+    names=<entries of root to consider>
+    returns the removed paths
+    '''
+    max_age = float(max_age or os.environ.get("GT_STAGING_MAX_AGE", 6 * 3600))
+    host = socket.gethostname()
+    removed = []
+    for name in names:
+        if not name.startswith((staging_prefix, trash_prefix)) or '@' not in name:
+            continue
+        path = os.path.join(root, name)
+        owner, owner_host = name.rsplit('@', 1)
+        try:
+            pid = int(owner.rsplit('-', 1)[-1])
+            age = time.time() - os.path.getmtime(path)
+        except (ValueError, OSError):
+            continue
+        #os.kill(pid, 0) would terminate the process on windows
+        dead = owner_host == host and os.name != 'nt' and pid != os.getpid() and not _pid_alive(pid)
+        if dead or age > max_age:
+            LOG.info("[staging] removing leftover {}".format(path))
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+            removed.append(path)
+    return removed
+
+
+class _LargeFile(object):
+    '''
+    a file copied as several chunks, renamed into place after the last one
+    '''
+    def __init__(self, src, dst, size, chunks, atomic):
+        self.src = src
+        self.dst = dst
+        self.target = _tmp_path(dst) if atomic else dst
+        self.remaining = chunks
+        self.lock = threading.Lock()
+        with open(self.target, 'wb') as fdst:
+            fdst.truncate(size)
+
+    def copy_chunk(self, offset, length):
+        with open(self.src, 'rb') as fsrc:
+            with open(self.target, 'r+b') as fdst:
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                while length > 0:
+                    block = fsrc.read(min(_block_size, length))
+                    if not block:
+                        break
+                    fdst.write(block)
+                    length -= len(block)
+        with self.lock:
+            self.remaining -= 1
+            done = not self.remaining
+        if done:
+            shutil.copystat(self.src, self.target)
+            if self.target != self.dst:
+                replace(self.target, self.dst)
+        return done
+
+
+class CopyEngine(object):
+    '''
+    Copies trees with a bounded thread pool.
+
+    Directories are created up front, files are then placed by the pool:
+    hardlinked where allowed, otherwise copied, with files over chunk_size
+    split into chunks copied in parallel. Per-file metadata round trips
+    overlap, which is what dominates on high-latency network filesystems.
+    workers=<pool size, default GT_COPY_WORKERS or 8>
+    chunk_size=<bytes, default GT_COPY_CHUNK or 64MB>
+    progress=<callable(stats) called at most every progress_interval seconds>
+    '''
+    def __init__(self, workers=None, chunk_size=None, progress=None, progress_interval=1.0):
+        self.workers = max(1, int(workers or os.environ.get("GT_COPY_WORKERS", 8)))
+        self.chunk_size = int(chunk_size or os.environ.get("GT_COPY_CHUNK", 64 << 20))
+        self.progress = progress
+        self.progress_interval = progress_interval
+
+    def _scan(self, src, dst, ignore):
+        dirs = []
+        files = []
+        for directory, subdirs, names in os.walk(src, followlinks=True):
+            skip = set(ignore(directory, subdirs + names)) if ignore else set()
+            subdirs[:] = [d for d in subdirs if d not in skip]
+            rel = os.path.relpath(directory, src)
+            target = os.path.normpath(os.path.join(dst, rel))
+            dirs.append((directory, target))
+            for name in names:
+                if name in skip:
+                    continue
+                src_path = os.path.join(directory, name)
+                files.append((src_path, os.path.join(target, name),
+                              os.path.normpath(os.path.join(rel, name)), os.path.getsize(src_path)))
+        return dirs, files
+
+    def _place(self, task):
+        '''
+        runs in the pool, returns (bytes, linked, file finished)
+        '''
+        if task[0] == 'chunk':
+            large, offset, length = task[1:]
+            return (length, False, large.copy_chunk(offset, length))
+        src_path, dst_path, link_src, size, atomic = task[1:]
+        if link_src and link(link_src, dst_path, atomic):
+            return (size, True, True)
+        fast_copy(src_path, dst_path, atomic)
+        return (size, False, True)
+
+    def copy_tree(self, src, dst, ignore=None, prev=None, compare='stat', link_src=False, prune=False):
+        '''
+        copy src to dst
+        ignore=<shutil.copytree style callable(directory, contents)>
+        prev=<previous copy of src: files unchanged since it are hardlinked from it>
+        compare=<'stat' or 'hash', see same_file>
+        link_src=<hardlink files from src itself, for immutable sources>
+        prune=<remove files in an existing dst that are not in src>
+        returns copy stats
+        '''
+        dst = os.path.normpath(dst)
+        existed = os.path.isdir(dst)
+        dirs, files = self._scan(src, dst, ignore)
+        return self._copy(src, dst, dirs, files, existed, prev, compare, link_src, prune)
+
+    def copy_files(self, src, dst, rel_paths):
+        '''
+        copy the given relative paths from src over dst, atomically per file
+        returns copy stats
+        '''
+        dst = os.path.normpath(dst)
+        dirs = {}
+        files = []
+        for rel in rel_paths:
+            rel = os.path.normpath(rel)
+            src_path = os.path.join(src, rel)
+            parent = os.path.dirname(rel)
+            dirs[os.path.join(src, parent)] = os.path.normpath(os.path.join(dst, parent))
+            files.append((src_path, os.path.join(dst, rel), rel, os.path.getsize(src_path)))
+        return self._copy(src, dst, sorted(dirs.items()), files, True)
+
+    def _copy(self, src, dst, dirs, files, existed, prev=None, compare='stat', link_src=False, prune=False):
+        start = time.time()
+        created = []
+        for directory, target in dirs:
+            if not os.path.isdir(target):
+                os.makedirs(target)
+                created.append((directory, target))
+
+        stats = {'files': len(files), 'files_copied': 0, 'files_linked': 0,
+                 'bytes': sum(entry[3] for entry in files),
+                 'bytes_copied': 0, 'bytes_linked': 0, 'workers': self.workers}
+        tasks = []
+        for src_path, dst_path, rel, size in files:
+            candidate = None
+            if link_src:
+                candidate = src_path
+            elif prev:
+                prev_path = os.path.join(prev, rel)
+                if same_file(src_path, prev_path, compare):
+                    candidate = prev_path
+            if size <= self.chunk_size:
+                tasks.append(('file', src_path, dst_path, candidate, size, existed))
+            elif candidate and link(candidate, dst_path, existed):
+                stats['files_linked'] += 1
+                stats['bytes_linked'] += size
+            else:
+                offsets = range(0, size, self.chunk_size)
+                large = _LargeFile(src_path, dst_path, size, len(offsets), existed)
+                tasks.extend(('chunk', large, offset, min(self.chunk_size, size - offset)) for offset in offsets)
+
+        last_report = time.time()
+        for size, linked, finished in pmap(self._place, tasks, self.workers):
+            if linked:
+                stats['files_linked'] += 1
+                stats['bytes_linked'] += size
+            else:
+                stats['files_copied'] += finished
+                stats['bytes_copied'] += size
+            if self.progress and time.time() - last_report >= self.progress_interval:
+                last_report = time.time()
+                stats['seconds'] = last_report - start
+                self.progress(dict(stats))
+
+        if prune and existed:
+            prune_tree(dst, set([target for directory, target in dirs] + [entry[1] for entry in files]))
+        for directory, target in reversed(created):
+            shutil.copystat(directory, target)
+        stats['seconds'] = time.time() - start
+        stats['throughput'] = stats['bytes_copied'] / stats['seconds'] if stats['seconds'] else 0
+        LOG.debug("[copy] {} -> {}: {} files, {} bytes copied, {} bytes linked in {:.2f}s".format(
+            src, dst, stats['files'], stats['bytes_copied'], stats['bytes_linked'], stats['seconds']))
+        if self.progress:
+            self.progress(dict(stats))
+        return stats
+
+
+def build_manifest(root, ignore=None, workers=None):
+    '''
+    {relative posix path: [size, sha1]} for every file under root
+    files are hashed on a bounded thread pool
+    ignore=<shutil.copytree style callable(directory, contents)>
+    '''
+    paths = []
+    for directory, dirs, files in os.walk(root, followlinks=True):
+        skip = set(ignore(directory, dirs + files)) if ignore else set()
+        dirs[:] = [d for d in dirs if d not in skip]
+        paths.extend(os.path.join(directory, name) for name in files if name not in skip)
+
+    def entry(path):
+        return (os.path.relpath(path, root).replace('\\', '/'), [os.path.getsize(path), file_hash(path)])
+
+    return dict(pmap(entry, paths, workers))
+
+
+def _list_dir(directory):
+    '''
+    [(name, is_dir, size, mtime)] of directory, symlinks followed
+    '''
+    entries = []
+    if scandir:
+        for entry in scandir(directory):
+            try:
+                if entry.is_dir():
+                    entries.append((entry.name, True, 0, 0))
+                else:
+                    st = entry.stat()
+                    entries.append((entry.name, False, st.st_size, st.st_mtime))
+            except OSError:
+                LOG.debug("skipped unreadable {}".format(entry.path))
+        return entries
+    for name in os.listdir(directory):
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            LOG.debug("skipped unreadable {}".format(os.path.join(directory, name)))
+            continue
+        entries.append((name, stat.S_ISDIR(st.st_mode), st.st_size, st.st_mtime))
+    return entries
+
+
+def scan_tree(root, ignore=None, workers=None):
+    '''
+    {relative posix path: (size, mtime)} of every file a copy of root would
+    include. directories are listed on a thread pool as they are found, with
+    scandir where it is available (py3 or the scandir package), so the stat
+    round trips of a large tree on a network share overlap. on a local disk
+    the hand-off between threads costs more than it saves, so it is single
+    threaded unless asked for
+    ignore=<shutil.copytree style callable(directory, contents)>
+    workers=<listing threads, default GT_SCAN_WORKERS or 1>
+    '''
+    def listing(rel):
+        directory = os.path.join(root, rel) if rel else root
+        try:
+            entries = _list_dir(directory)
+            skip = set(ignore(directory, [entry[0] for entry in entries])) if ignore else set()
+            return rel, [entry for entry in entries if entry[0] not in skip], None
+        except BaseException as err:
+            #a pool never calls back for a raising task, the loop would wait forever
+            return rel, [], err
+
+    files = {}
+    workers = max(1, int(workers or os.environ.get("GT_SCAN_WORKERS", 1)))
+    pool = ThreadPool(workers) if workers > 1 else None
+    done = Queue.Queue()
+    outstanding = 1
+    done.put(listing(''))
+    try:
+        while outstanding:
+            rel, entries, err = util.queue_get(done)
+            outstanding -= 1
+            if err:
+                raise err
+            for name, is_dir, size, mtime in entries:
+                path = rel + '/' + name if rel else name
+                if not is_dir:
+                    files[path] = (size, mtime)
+                elif pool:
+                    outstanding += 1
+                    pool.apply_async(listing, (path,), callback=done.put)
+                else:
+                    outstanding += 1
+                    done.put(listing(path))
+        if pool:
+            pool.close()
+    except BaseException:
+        if pool:
+            pool.terminate()
+        raise
+    finally:
+        if pool:
+            pool.join()
+    return files
+
+
+def filter_paths(top, rel_paths, ignore):
+    '''
+    the relative posix paths under top a copy with ignore would include,
+    for name based ignore callables like ignore_names
+    '''
+    skipped = {}
+
+    def skip(parent, name):
+        if (parent, name) not in skipped:
+            directory = os.path.join(top, *parent.split('/')) if parent else top
+            skipped[(parent, name)] = name in ignore(directory, [name])
+        return skipped[(parent, name)]
+
+    kept = []
+    for rel in rel_paths:
+        parts = rel.split('/')
+        if not any(skip('/'.join(parts[:i]), parts[i]) for i in range(len(parts))):
+            kept.append(rel)
+    return kept
+
+
+def diff_manifest(old, new):
+    '''
+    returns (added, changed, removed) relative paths between two manifests
+    '''
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(rel for rel in set(new) & set(old) if new[rel] != old[rel])
+    return added, changed, removed
+
+
+def remove_files(root, rel_paths):
+    '''
+    delete rel_paths under root and any directories they leave empty
+    '''
+    root = os.path.normpath(root)
+    for rel in rel_paths:
+        path = os.path.normpath(os.path.join(root, rel))
+        if os.path.lexists(path):
+            os.remove(path)
+        parent = os.path.dirname(path)
+        while parent != root and os.path.isdir(parent) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+
+def tree_usage(roots, workers=None):
+    '''
+    bytes freed by deleting every tree in roots, walked in parallel
+    files also hardlinked from outside roots are not counted,
+    files linked between them are counted once
+    '''
+    def scan(root):
+        entries = []
+        for directory, dirs, files in os.walk(root):
+            for name in files:
+                path = os.path.join(directory, name)
+                st = os.lstat(path)
+                #st_ino is 0 on windows py2, count each path on its own there
+                entries.append(((st.st_dev, st.st_ino) if st.st_ino else path, st.st_nlink, st.st_size))
+        return entries
+
+    seen = {}
+    for entries in pmap(scan, list(roots), workers):
+        for key, nlink, size in entries:
+            count = seen.get(key, (0, nlink, size))[0]
+            seen[key] = (count + 1, nlink, size)
+    return sum(size for count, nlink, size in seen.values() if count >= nlink)
+
+
+def remove_trees(paths, workers=None):
+    '''
+    rmtree every path on a thread pool
+    returns {path: error} for the ones that could not be removed
+    '''
+    def remove(path):
+        try:
+            shutil.rmtree(path)
+            return (path, None)
+        except OSError as err:
+            return (path, str(err))
+    return dict((path, err) for path, err in pmap(remove, list(paths), workers) if err)
+
+
+def link_copy_tree(src, dst, prev=None, compare='stat', ignore=None, **kw):
+    '''
+    copy src to dst like shutil.copytree
+    files unchanged since the prev tree are hardlinked from it instead of copied
+    prev=<previous copy of src, None copies everything>
+    compare=<'stat' or 'hash', see same_file>
+    ignore=<shutil.copytree style callable(directory, contents)>
+    kw are passed to CopyEngine
+    returns copy stats
+    '''
+    return CopyEngine(**kw).copy_tree(src, dst, ignore=ignore, prev=prev, compare=compare)
+
+
+def deploy_tree(src, dst, ignore=None, link=None, **kw):
+    '''
+    place an immutable tree (a build) at dst without a second full copy
+    files are hardlinked when src and dst share a filesystem and copied
+    on the copy pool otherwise, each one swapped in with an atomic rename.
+    files left in an existing dst that are not in src are removed.
+    ignore=<shutil.copytree style callable(directory, contents)>
+    link=<force hardlinking on/off, default same_device(src, dst)>
+    kw are passed to CopyEngine
+    returns copy stats
+    '''
+    if link is None:
+        link = same_device(src, dst)
+    return CopyEngine(**kw).copy_tree(src, dst, ignore=ignore, link_src=link, prune=True)
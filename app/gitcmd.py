@@ -0,0 +1,309 @@
+import os
+import re
+import time
+import signal
+import logging
+import threading
+import subprocess
+import collections
+
+import alloc
+import timing
+
+LOG = logging.getLogger(__name__)
+
+_ls_remote_regx = re.compile(r"^(\S+)\s+refs/tags/(\S+?)(\^\{\})?$")
+
+GitResult = collections.namedtuple('GitResult', 'args returncode out err elapsed')
+
+_installed = {}
+_installed_lock = threading.Lock()
+
+
+class GitCmdError(Exception):
+    def __init__(self, result):
+        self.result = result
+        msg = "[git {}]: \n{}{}".format(" ".join(result.args), result.err, result.out)
+        super(GitCmdError, self).__init__(msg)
+
+
+class GitCacheError(Exception):
+    pass
+
+
+def parse_ls_remote(output):
+    '''
+    parse `git ls-remote --tags` output
+    returns {tag name: [tag object id, peeled commit id or None]}
+    annotated tags get their commit from the peeled ^{} line
+    '''
+    refs = {}
+    for line in output.splitlines():
+        match = _ls_remote_regx.match(line.strip())
+        if not match:
+            continue
+        sha, name, peeled = match.groups()
+        entry = refs.setdefault(name, [None, None])
+        if peeled:
+            entry[1] = sha
+        else:
+            entry[0] = sha
+    return refs
+
+
+def update_cache(cache, name, url, timeout=None):
+    '''
+    fetch url into the machine wide object cache, a bare repo at
+    <cache>/objects.git created on first use. refs are kept under
+    refs/cache/<name>/ so packages never clash. clones borrow objects from
+    it through alternates, it must only ever gain objects: auto gc and
+    pruning are turned off when it is created, do not prune it by hand.
+    the full history is fetched whatever the clone depth, a shallow cache
+    can't be borrowed from. the first clone of a package downloads it all,
+    later clones (of any depth) only what the cache lacks
+    timeout=<seconds a fetch may take and a waiter waits for the one in
+             progress, default GT_REPO_CACHE_TIMEOUT or 3600>
+    returns the cache repo path, raises GitCacheError if the cache stays busy
+    '''
+    repo = os.path.join(cache, 'objects.git')
+    timeout = float(timeout or os.environ.get("GT_REPO_CACHE_TIMEOUT", 3600))
+    #one writer at a time, across processes and hosts sharing the cache. the
+    #fetch is killed at timeout, so a lock older than twice that is stale
+    lock = alloc.Counter(cache, 'objects', timeout=timeout, stale=timeout * 2)
+    try:
+        with lock.locked():
+            if not os.path.isdir(repo):
+                Git().run("init", "--quiet", "--bare", repo)
+                cache_git = Git(repo)
+                #a gc --auto after a fetch could drop objects the clones still use
+                cache_git.run("config", "gc.auto", "0")
+                cache_git.run("config", "gc.pruneExpire", "never")
+            Git(repo).run("fetch", "--quiet", "--no-tags", url,
+                          "+refs/heads/*:refs/cache/{}/heads/*".format(name),
+                          "+refs/tags/*:refs/cache/{}/tags/*".format(name),
+                          timeout=timeout)
+    except alloc.AllocError as err:
+        raise GitCacheError("[{}] object cache is busy >> {}".format(cache, err))
+    return repo
+
+
+def check_installed():
+    '''
+    run `git --version` once per process, raises GitCmdError/OSError if git is unusable
+    '''
+    with _installed_lock:
+        if 'version' not in _installed:
+            _installed['version'] = Git().run("--version").out.strip()
+        return _installed['version']
+
+
+class _CatFile(object):
+    '''
+    long-lived `git cat-file --batch[-check]` process
+    '''
+    def __init__(self, cwd, mode):
+        self.mode = mode
+        self.proc = subprocess.Popen(["git", "cat-file", mode],
+                                     cwd=cwd,
+                                     stdin=subprocess.PIPE,
+                                     stderr=subprocess.PIPE,
+                                     stdout=subprocess.PIPE)
+
+    def query(self, obj_id):
+        '''
+        returns (object id, type, size, content or None), type is None if missing
+        '''
+        self.proc.stdin.write(obj_id + "\n")
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline()
+        if not header:
+            raise Exception("[git cat-file {}]: process exited".format(self.mode))
+        parts = header.split()
+        if len(parts) != 3:
+            return (obj_id, None, 0, None)
+        content = None
+        if self.mode == '--batch':
+            content = self.proc.stdout.read(int(parts[2]))
+            self.proc.stdout.read(1)
+        return (parts[0], parts[1], int(parts[2]), content)
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+            self.proc.wait()
+        except Exception:
+            pass
+
+
+class Git(object):
+    '''
+    git execution layer for one working tree
+    commands run without a shell with an explicit cwd, are timed
+    and return GitResult tuples. object queries go through persistent
+    cat-file processes, one per mode, guarded by a lock.
+    cwd=<working tree>
+    '''
+    def __init__(self, cwd=None):
+        self.cwd = cwd
+        self.calls = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._batch = {}
+
+    def run(self, *args, **kw):
+        '''
+        run `git <args>`
+        cwd=<override working dir>
+        input=<data for stdin>
+        check=<raise GitCmdError on non-zero exit, default True>
+        timeout=<seconds before the process is killed, its err says it timed out>
+        '''
+        data = kw.get('input', None)
+        start = time.time()
+        #own process group so a timeout also kills ssh/upload-pack children
+        group = kw.get('timeout') and os.name != 'nt'
+        proc = subprocess.Popen(["git"] + list(args),
+                                cwd=kw.get('cwd', self.cwd),
+                                stdin=subprocess.PIPE if data is not None else None,
+                                stderr=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                preexec_fn=os.setsid if group else None)
+        killed = []
+        timer = None
+        if kw.get('timeout'):
+            #communicate has no timeout in py2
+            def kill():
+                killed.append(True)
+                try:
+                    if group:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    else:
+                        proc.kill()
+                except OSError:
+                    pass
+            timer = threading.Timer(kw['timeout'], kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            out, err = proc.communicate(data)
+        finally:
+            if timer:
+                timer.cancel()
+        if killed:
+            err = "timed out after {}s\n{}".format(kw['timeout'], err)
+        result = GitResult(args, proc.returncode, out, err, time.time() - start)
+        with self._lock:
+            self.calls += 1
+            self.elapsed += result.elapsed
+        timing.record("git " + args[0], result.elapsed, args=" ".join(args), returncode=result.returncode)
+        LOG.debug("[git {}] exit {} in {:.3f}s".format(" ".join(args), result.returncode, result.elapsed))
+        if kw.get('check', True) and result.returncode:
+            raise GitCmdError(result)
+        return result
+
+    def cat_file(self, obj_id, mode='--batch-check'):
+        '''
+        query one object through the persistent cat-file process
+        '''
+        with self._lock:
+            proc = self._batch.get(mode)
+            if not proc or proc.proc.poll() is not None:
+                proc = self._batch[mode] = _CatFile(self.cwd, mode)
+                self.calls += 1
+            return proc.query(obj_id)
+
+    def object_types(self, ids):
+        '''
+        returns {object id: type or None if the object is missing}
+        '''
+        return dict((obj_id, self.cat_file(obj_id)[1]) for obj_id in ids)
+
+    def ls_remote_tags(self, remote):
+        '''
+        single `git ls-remote --tags` call against remote
+        '''
+        return parse_ls_remote(self.run("ls-remote", "--tags", remote).out)
+
+    def resolve_tag_commits(self, refs, missing_as_commit=False):
+        '''
+        resolve the commit of every tag in parse_ls_remote output
+        peeled lines are used as-is, remaining ids are checked through cat-file
+        missing_as_commit=<ids not in the local object store are taken as
+                           commits, for shallow/partial clones: ls-remote only
+                           leaves lightweight tags unpeeled>
+        returns {tag name: commit id}, tags that can't be resolved are left out
+        '''
+        results = {}
+        unpeeled = []
+        for name, (tag_id, peeled) in refs.items():
+            if peeled:
+                results[name] = peeled
+            elif tag_id:
+                unpeeled.append((name, tag_id))
+
+        types = self.object_types([tag_id for name, tag_id in unpeeled])
+        for name, tag_id in unpeeled:
+            if types.get(tag_id) == 'commit' or (missing_as_commit and types.get(tag_id) is None):
+                results[name] = tag_id
+        return results
+
+    def clone(self, url, dest, **kw):
+        '''
+        clone url into dest
+        branch=<branch to check out>
+        depth=<shallow clone of the last depth commits>
+        filter=<partial clone filter, e.g. blob:none>
+        sparse=<paths to check out, everything else stays out of the work tree>
+        reference=<repo to borrow objects from through alternates>
+        '''
+        args = ["clone", "--quiet"]
+        if kw.get('branch'):
+            args += ["-b", kw['branch']]
+        if kw.get('depth'):
+            args += ["--depth", str(kw['depth'])]
+        if kw.get('filter'):
+            args += ["--filter={}".format(kw['filter'])]
+        if kw.get('sparse'):
+            args += ["--sparse"]
+        if kw.get('reference'):
+            args += ["--reference-if-able", kw['reference']]
+        self.run(*(args + [url, dest]), cwd=os.path.dirname(dest) or None)
+        if kw.get('sparse'):
+            self.run("sparse-checkout", "set", *kw['sparse'], cwd=dest)
+
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.cwd, '.git', 'shallow'))
+
+    def current_branch(self):
+        '''
+        branch name read from HEAD, None when detached
+        '''
+        head = os.path.join(self.cwd, '.git', 'HEAD')
+        if os.path.isfile(head):
+            with open(head) as hfile:
+                ref = hfile.read().strip()
+            if ref.startswith("ref: refs/heads/"):
+                return ref[len("ref: refs/heads/"):]
+            return None
+        result = self.run("symbolic-ref", "--short", "-q", "HEAD", check=False)
+        return result.out.strip() or None
+
+    def fetch_age(self):
+        '''
+        seconds since the last fetch (FETCH_HEAD mtime), None if never fetched
+        '''
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self.cwd, '.git', 'FETCH_HEAD'))
+        except OSError:
+            return None
+
+    def reset(self):
+        '''
+        restart cat-file processes, e.g. after a fetch
+        '''
+        with self._lock:
+            for proc in self._batch.values():
+                proc.close()
+            self._batch.clear()
+
+    close = reset
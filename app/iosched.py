@@ -0,0 +1,176 @@
+'''
+caps how many jobs copy to or from the same filesystem at once, so
+concurrent deploys on one share do not slow each other down, and lets
+publishes (small, someone is waiting on them) go ahead of builds
+GT_IO_LIMIT=<jobs per filesystem at once, default 2, 0 for no cap>
+GT_IO_LIMITS=<per root overrides, e.g. /mnt/builds=4,/mnt/deploy=1>
+'''
+import os
+import time
+import logging
+import threading
+import itertools
+import contextlib
+
+import timing
+import util
+
+LOG = logging.getLogger(__name__)
+
+#lower goes first
+priorities = {'publish': 0, 'deploy_release': 1, 'build_release': 1}
+
+
+def device(path):
+    '''
+    key of the filesystem path is on, the nearest existing parent is used
+    for a path that does not exist yet. drive or share where st_dev is not
+    meaningful (windows)
+    '''
+    path = os.path.abspath(path)
+    probe = path
+    while not os.path.exists(probe) and os.path.dirname(probe) != probe:
+        probe = os.path.dirname(probe)
+    try:
+        dev = os.stat(probe).st_dev
+    except OSError:
+        dev = 0
+    if dev:
+        return 'dev:{}'.format(dev)
+    return 'drive:{}'.format(os.path.splitdrive(path)[0].lower() or os.sep)
+
+
+def job_roots(pkg, action):
+    '''
+    storage roots an action of pkg reads or writes
+    '''
+    if action == 'publish':
+        names = ['deploy_root']
+    elif action == 'build_release':
+        names = ['local_root', 'build_root']
+    else:
+        names = ['local_root', 'build_root', 'deploy_root']
+    roots = []
+    for name in names:
+        try:
+            roots.append(getattr(pkg, name))
+        except Exception:
+            LOG.debug("[{}] no {}".format(getattr(pkg, 'name', pkg), name), exc_info=True)
+    if action == 'publish' and getattr(pkg, 'root', None) == 'cfg':
+        cfg_root = os.environ.get(pkg._root_map.get('cfg'))
+        if cfg_root:
+            roots.append(cfg_root)
+    return roots
+
+
+class IOScheduler(object):
+    '''
+    per filesystem slots for heavy I/O jobs. a job waits until every
+    filesystem it touches has a free slot and no job of a higher priority
+    (or an earlier one of the same priority) is waiting on one of them.
+    limit=<slots per filesystem, default GT_IO_LIMIT or 2, 0 for no cap>
+    limits=<{root: slots} for the filesystems of some roots, default GT_IO_LIMITS>
+    '''
+    def __init__(self, limit=None, limits=None):
+        self.limit = int(os.environ.get("GT_IO_LIMIT", 2) if limit is None else limit)
+        if limits is None:
+            limits = {}
+            for item in os.environ.get("GT_IO_LIMITS", "").split(','):
+                if '=' in item:
+                    root, slots = item.rsplit('=', 1)
+                    limits[root.strip()] = int(slots)
+        self.limits = dict((device(root), int(slots)) for root, slots in limits.items())
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._active = {}
+        self._waiting = []
+        self._devices = {}
+        self._actions = {}
+
+    def _limit(self, dev):
+        return self.limits.get(dev, self.limit)
+
+    def _grantable(self, ticket):
+        rank, devs = ticket[:2], ticket[2]
+        for dev in devs:
+            limit = self._limit(dev)
+            if limit and self._active.get(dev, 0) >= limit:
+                return False
+        for other in self._waiting:
+            if other[:2] < rank and set(other[2]) & set(devs):
+                return False
+        return True
+
+    def _stats(self, dev, root):
+        if dev not in self._devices:
+            self._devices[dev] = {'root': root, 'limit': self._limit(dev), 'granted': 0,
+                                  'max_waiting': 0, 'wait_seconds': 0.0, 'max_wait': 0.0}
+        return self._devices[dev]
+
+    @contextlib.contextmanager
+    def slot(self, action, roots):
+        '''
+        hold a slot on the filesystem of every root for the block
+        action=<job action, sets the priority>
+        '''
+        devs = {}
+        for root in roots:
+            if root:
+                devs.setdefault(device(root), root)
+        ticket = (priorities.get(action, 1), next(self._seq), sorted(devs))
+        start = time.time()
+        with timing.span('io_wait', action=action) as span:
+            with self._cond:
+                self._waiting.append(ticket)
+                for dev, root in devs.items():
+                    stats = self._stats(dev, root)
+                    waiting = sum(1 for other in self._waiting if dev in other[2])
+                    stats['max_waiting'] = max(stats['max_waiting'], waiting)
+                try:
+                    while not self._grantable(ticket):
+                        self._cond.wait(1)
+                finally:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+                waited = time.time() - start
+                for dev in devs:
+                    self._active[dev] = self._active.get(dev, 0) + 1
+                    stats = self._devices[dev]
+                    stats['granted'] += 1
+                    stats['wait_seconds'] += waited
+                    stats['max_wait'] = max(stats['max_wait'], waited)
+                by_action = self._actions.setdefault(action, {'granted': 0, 'wait_seconds': 0.0, 'max_wait': 0.0})
+                by_action['granted'] += 1
+                by_action['wait_seconds'] += waited
+                by_action['max_wait'] = max(by_action['max_wait'], waited)
+            span.set(waited=waited)
+        try:
+            yield
+        finally:
+            with self._cond:
+                for dev in devs:
+                    self._active[dev] -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        '''
+        {'devices': {dev: {'root', 'limit', 'active', 'waiting', 'max_waiting',
+                           'granted', 'wait_seconds', 'max_wait'}},
+         'actions': {action: {'granted', 'wait_seconds', 'max_wait'}}, 'waiting'}
+        '''
+        with self._cond:
+            devices = {}
+            for dev, stats in self._devices.items():
+                devices[dev] = dict(stats, active=self._active.get(dev, 0),
+                                    waiting=sum(1 for other in self._waiting if dev in other[2]))
+            return {'devices': devices, 'waiting': len(self._waiting),
+                    'actions': dict((action, dict(stats)) for action, stats in self._actions.items())}
+
+
+def format_stats(stats):
+    rows = [("root", "limit", "active", "waiting", "max waiting", "granted", "avg wait", "max wait")]
+    for dev, data in sorted(stats['devices'].items(), key=lambda item: item[1]['root']):
+        rows.append((data['root'], data['limit'] or '-', data['active'], data['waiting'], data['max_waiting'],
+                     data['granted'], "{:.2f}".format(data['wait_seconds'] / max(1, data['granted'])),
+                     "{:.2f}".format(data['max_wait'])))
+    return util.format_columns(rows)
@@ -0,0 +1,112 @@
+'''
+packed release artifacts: one zip (zipimport-able) or tar per version
+with a json sidecar index next to it
+'''
+import os
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import fileops
+
+formats = ('zip', 'tar')
+suffixes = tuple('.' + fmt for fmt in formats)
+
+
+class PackError(BaseException):
+    pass
+
+
+def archive_path(root, name, fmt):
+    return os.path.join(root, "{}.{}".format(name, fmt))
+
+
+def index_path(archive):
+    return archive + '.json'
+
+
+def pack(src, archive, fmt='zip'):
+    '''
+    write the tree at src into archive, swapped in with a rename
+    returns the index: {'format', 'files': {relative path: [size, data offset]}, 'bytes', 'seconds'}
+    '''
+    if fmt not in formats:
+        raise PackError("Unknown pack format [{}], expected one of {}".format(fmt, formats))
+    #imported here, pkg imports this module on every run for the suffixes
+    import tarfile
+    import zipfile
+    start = time.time()
+    paths = []
+    for directory, dirs, files in os.walk(src):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            paths.append((path, os.path.relpath(path, src).replace('\\', '/')))
+
+    tmp = archive + '.tmp'
+    files = {}
+    try:
+        if fmt == 'zip':
+            with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zfile:
+                for path, rel in paths:
+                    zfile.write(path, rel)
+                for info in zfile.infolist():
+                    files[info.filename] = [info.file_size, info.header_offset]
+        else:
+            tfile = tarfile.open(tmp, 'w')
+            try:
+                for path, rel in paths:
+                    tfile.add(path, rel, recursive=False)
+            finally:
+                tfile.close()
+            tfile = tarfile.open(tmp, 'r')
+            try:
+                for info in tfile.getmembers():
+                    files[info.name] = [info.size, info.offset_data]
+            finally:
+                tfile.close()
+        fileops.replace(tmp, archive)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    return {'format': fmt, 'files': files,
+            'bytes': os.path.getsize(archive), 'seconds': time.time() - start}
+
+
+def write_index(archive, index):
+    path = index_path(archive)
+    with open(path + '.tmp', 'w') as ifile:
+        json.dump(index, ifile, indent=4)
+    fileops.replace(path + '.tmp', path)
+
+
+def read_index(archive):
+    '''
+    sidecar index of archive, None if it has none
+    '''
+    path = index_path(archive)
+    if not os.path.exists(path):
+        return None
+    with open(path) as ifile:
+        return json.load(ifile)
+
+
+def extract(archive, dst):
+    '''
+    unpack archive into dst
+    '''
+    import tarfile
+    import zipfile
+    if archive.endswith('.zip'):
+        with zipfile.ZipFile(archive) as zfile:
+            zfile.extractall(dst)
+    else:
+        tfile = tarfile.open(archive)
+        try:
+            tfile.extractall(dst)
+        finally:
+            tfile.close()
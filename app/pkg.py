@@ -2,12 +2,12 @@
 import os,sys
 import re
 import shutil
-import inspect
-import subprocess
-#import paramiko
+import tempfile
+import time
 import logging
 import posixpath
 import socket
+import threading
 
 from pprint import pformat as pp
 
@@ -17,12 +17,15 @@ except ImportError:
     import json
     
 import datetime
-import distutils.dir_util as dir_util
 
 from gtcfg.pkg import BasePkg
 from gtcfg.cfg import PkgCfg
 import gtcfg.cfg
 
+from tags import TagIndex, TagTable
+import tags
+import timing
+
 class PkgEnvError(BaseException):
     pass
 
@@ -35,6 +38,9 @@ class PkgVersionError(BaseException):
 class PkgPublishError(BaseException):
     pass
 
+class PkgServerError(BaseException):
+    pass
+
 
 class RepoPkgEnvError(BaseException):
     pass
@@ -65,6 +71,7 @@ LOG = logging.getLogger(__name__)
 
 class RepoTag(object):
     _config_fields = []
+    __slots__ = ('id', 'commit', 'name', 'notes', 'path', 'branch')
     def __init__(self, **kw):
         self.id = kw.get("id", None)
         self.commit = kw.get("commit", None)
@@ -74,7 +81,7 @@ class RepoTag(object):
         self.branch = kw.get("branch", None)
     
     def dump(self):
-        data = self.__dict__.copy()
+        data = dict((attr, getattr(self, attr)) for attr in self.__slots__)
         if self._config_fields:
             _skip = set(data.keys()) - set(self._config_fields)
             for attr in _skip:
@@ -85,12 +92,16 @@ class RepoTag(object):
 
 class RepoUser(object):
     _config_fields = []
+    _host = None
     def __init__(self):
         self.login = os.environ.get("USERNAME",os.environ.get("USER"))
         self.home = os.environ.get("USERPROFILE",os.environ.get("HOME")).replace('\\','/')
         self.ssh_key = posixpath.join(self.home,".ssh","id_rsa.pub").replace("\\","/")
-        self.hostname = socket.gethostname()
-        self.ip = socket.gethostbyname(self.hostname)
+        #resolved once per process, a dns lookup per build log adds up
+        if RepoUser._host is None:
+            hostname = socket.gethostname()
+            RepoUser._host = (hostname, socket.gethostbyname(hostname))
+        self.hostname, self.ip = RepoUser._host
     
     def dump(self):
         data = self.__dict__.copy()
@@ -102,6 +113,109 @@ class RepoUser(object):
         return data    
 
 
+class PkgCfgBatch(object):
+    '''
+    Collects publish upserts against the pkg configs in memory.
+    The config chain is loaded once, project lookups are cached and
+    commit() dumps each touched PkgCfg once.
+    commit() replays the upserts onto a freshly loaded chain when the loaded
+    one is older than ttl, so configs edited elsewhere since the load are
+    updated, not overwritten. upserts not dumped stay pending for the next commit.
+    ttl=<seconds a loaded chain is trusted at commit, default GT_CFG_BATCH_TTL or 2>
+    '''
+    def __init__(self, ttl=None):
+        self.ttl = float(os.environ.get("GT_CFG_BATCH_TTL", 2) if ttl is None else ttl)
+        self._lock = threading.Lock()
+        self._upserts = {}
+        self._load()
+    
+    def _load(self):
+        self._cfg_list = gtcfg.cfg.get_configs('pkg')
+        self._chain = gtcfg.cfg.CfgChain(cfg_type='pkg', cfg_list=self._cfg_list)
+        self._next_id = max([int(cfg.id) for cfg in self._cfg_list] or [0]) + 1
+        self._projects = {}
+        self._loaded = time.time()
+    
+    def _get(self, project):
+        if project not in self._projects:
+            _PkgCfg = self._chain.find_one(value=project)
+            if not _PkgCfg:
+                #should validate against shotgun
+                _PkgCfg = gtcfg.cfg.init_cfg({"type":'pkg','id':self._next_id,'code':project.lower()})
+                self._next_id += 1
+            self._projects[project] = _PkgCfg
+        return self._projects[project]
+    
+    def get(self, project):
+        '''
+        PkgCfg for project as last loaded or committed, a new one is created
+        if none exists
+        '''
+        with self._lock:
+            return self._get(project)
+    
+    def upsert(self, project, data):
+        with self._lock:
+            self._upserts.setdefault(project, []).append(data)
+    
+    def commit(self):
+        '''
+        dump every PkgCfg touched since the last commit, once
+        returns the committed projects
+        '''
+        return self._commit(self._upserts)
+    
+    def scope(self):
+        '''
+        batch for one job on top of this one: same chain and lookups, but its
+        commit() only dumps the upserts made through it
+        '''
+        return PkgCfgScope(self)
+    
+    def _commit(self, upserts):
+        '''
+        dump the projects of upserts {project: [data]}, each one is removed
+        from it once dumped
+        '''
+        with self._lock:
+            if not upserts:
+                return []
+            if time.time() - self._loaded > self.ttl:
+                self._load()
+            committed = []
+            try:
+                for project in sorted(upserts):
+                    _PkgCfg = self._get(project)
+                    for data in upserts[project]:
+                        _PkgCfg.upsert(data)
+                    _PkgCfg.dump()
+                    del upserts[project]
+                    committed.append(project)
+            except BaseException:
+                #the cached configs hold upserts that were not dumped
+                self._loaded = 0
+                raise
+            return committed
+
+
+class PkgCfgScope(object):
+    '''
+    the upserts of one job against a shared PkgCfgBatch, see PkgCfgBatch.scope
+    '''
+    def __init__(self, batch):
+        self.batch = batch
+        self._upserts = {}
+    
+    def get(self, project):
+        return self.batch.get(project)
+    
+    def upsert(self, project, data):
+        self._upserts.setdefault(project, []).append(data)
+    
+    def commit(self):
+        return self.batch._commit(self._upserts)
+
+
 class Pkg(BasePkg):
     '''
     Class to manage deployment packages
@@ -112,6 +226,14 @@ class Pkg(BasePkg):
     _config_fields = ['name','version','root','platform','type']
     _buildlog = "buildlog.json"
     _release_notes = "release_notes.json"
+    _manifest = ".manifest.json"
+    _build_ignore = ['.git']
+    #whatever branch you're on just put it on network
+    #leave it to user to update repo
+    _deploy_ignore = ['.git','.pyc','.gitignore']
+    #plan phase of each timed span in a build log, the others are overhead
+    _plan_phases = {'copy': 'build', 'deploy': 'deploy', 'compile': 'compile', 'manifest': 'manifest', 'pack': 'pack'}
+    _plan_sample = {'files': 100, 'bytes': 1 << 20}
     def __init__(self, **kw):
         super(Pkg, self).__init__(**kw)
         for evar in Pkg._required_env:
@@ -119,59 +241,116 @@ class Pkg(BasePkg):
                 os.environ[evar]
             except Exception as err:
                 raise PkgEnvError("Required environment variable [{}] not found!!".format(evar))
-        self._build_tags = []
-        self._version_tags = []
-
-    def _get_next_tag(self, release_type=None):
-        if not release_type:
-            return RepoTag(name="rc{}".format(str(int(self.build_tag.name.split("rc")[-1])+1)).zfill(3))
-
-        major,minor,bug = self.version_tag.name.split(".")
-        major = int(major)
-        minor = int(minor)
-        bug = int(bug)
-        if release_type == 'major':
-            major += 1
-            minor = 0
-            bug = 0
-        elif release_type == 'minor':
-            minor += 1
-            bug = 0
-        elif release_type == 'bug':
-            bug += 1
-            
-        return RepoTag(name="{}.{}.{}".format(major,minor,bug))
+        self._build_tags = TagTable(builds=True)
+        self._version_tags = TagTable()
+        self._tag_indexes = {}
+        self._reserved = {}
+
+    def tag_index(self, builds=False):
+        '''
+        cached TagIndex for the build or deploy root
+        '''
+        import pack
+        if builds:
+            root = self.build_root
+            key = (self._valid_build, tags.build_key)
+            packed = ()
+        else:
+            root = self.deploy_root
+            key = (self._valid_version, tags.version_key)
+            packed = pack.suffixes
+        if root not in self._tag_indexes:
+            self._tag_indexes[root] = TagIndex(root, *key, packed=packed)
+        return self._tag_indexes[root]
+
+    def _tag_counter(self, release_type=None):
+        '''
+        (counter, seed, taken) of the build or version tags, see alloc.Counter.reserve
+        '''
+        import pack
+        import alloc
+        if release_type:
+            counter = alloc.Counter(self.deploy_root, 'version')
+            seed = lambda: self.version_tag.name
+            taken = lambda name: any(os.path.exists(p) for p in
+                                     [posixpath.join(self.deploy_root, name)] +
+                                     [pack.archive_path(self.deploy_root, name, f) for f in pack.formats])
+        else:
+            counter = alloc.Counter(self.build_root, 'build')
+            seed = lambda: self.build_tag.name
+            taken = lambda name: os.path.exists(posixpath.join(self.build_root, name))
+        return counter, seed, taken
+
+    def reserve_tag(self, release_type=None):
+        '''
+        allocate the next build tag, or version tag for release_type, through
+        a counter file in the build/deploy root. safe between concurrent
+        builds on any host sharing the root, see alloc.Counter.
+        the directory is scanned only to seed a root without a counter.
+        '''
+        counter, seed, taken = self._tag_counter(release_type)
+        name = counter.reserve(lambda last: tags.next_name(last, release_type), seed, taken)
+        if release_type:
+            #for release_tag, failed builds keep burning their rc
+            self._reserved[name] = counter.last
+        return RepoTag(name=name)
+
+    def release_tag(self, tag, release_type):
+        '''
+        give back a version from reserve_tag that was never created, so a
+        failed deploy does not burn it. it stays burned when a later version
+        was reserved meanwhile or something exists under its name
+        returns True if released
+        '''
+        previous = self._reserved.pop(tag.name, None)
+        if previous is None:
+            return False
+        counter, seed, taken = self._tag_counter(release_type)
+        if taken(tag.name):
+            return False
+        return counter.release(tag.name, previous)
+
+    def peek_tag(self, release_type=None):
+        '''
+        the tag reserve_tag would allocate now, nothing is reserved
+        '''
+        counter, seed, taken = self._tag_counter(release_type)
+        return RepoTag(name=counter.peek(lambda last: tags.next_name(last, release_type), seed, taken))
     
     def _get_tag_commit(self, tag):
         """
-        read it off filesystem
+        read it off filesystem, packed tags from their sidecar index
         """
-        build_path = posixpath.join(self.build_root, tag.name, self._buildlog)
+        import pack
+        build_path = posixpath.join(tag.path or posixpath.join(self.build_root, tag.name), self._buildlog)
         try:
             data={}
-            with open(build_path) as bfile:
-                data = json.load(bfile)
-                tag.commit = data['RepoTag']['commit']
+            if tag.path and tag.path.endswith(pack.suffixes):
+                data = pack.read_index(tag.path)['buildlog']
+            else:
+                with open(build_path) as bfile:
+                    data = json.load(bfile)
+            tag.commit = data.get('tag', data.get('RepoTag', {}))['commit']
         except:
             pass
         
+    @timing.timed('tags')
     def _get_tags(self, builds=False, force=False):
         '''
         '''
         results = []
         try:
-            if builds:
-                tags = self.builds
-            else:
-                tags = self.versions
-                
-            for tag_ref in tags:
+            index = self.tag_index(builds=builds)
+            for tag_ref, path in index.items():
                 tag = RepoTag(**{'name': tag_ref})
-                self._get_tag_commit(tag)
-                tag.path = posixpath.join(self.deploy_root,tag.name)
-                if builds:    
-                    tag.path = posixpath.join(self.build_root,tag.name)
+                tag.path = path
+                if index.has_commit(tag.name):
+                    tag.commit = index.get_commit(tag.name)
+                else:
+                    self._get_tag_commit(tag)
+                    index.set_commit(tag.name, tag.commit)
                 results.append(tag)
+            results = TagTable(results, builds=builds)
             
             if builds:
                 self._build_tags = results
@@ -201,56 +380,21 @@ class Pkg(BasePkg):
     @property
     def versions(self):
         '''
-        need caching
+        cached by tag_index, rescanned only when deploy_root changes
         '''
-        results = []
-        v_regex = re.compile(r'^(\d+?.\d+?.\d+?)')
-        if os.path.exists(self.deploy_root):
-            path_list = os.listdir(self.deploy_root)
-            for item in os.listdir(self.deploy_root):
-                path = posixpath.join(self.deploy_root, item)
-                if os.path.isdir(path):
-                    match = self._valid_version.match(item)
-                    if match:
-                        results.append(item)
-        
-        results.sort(key=lambda v: [int(n) for n in v.split('.')])
-        
-        return results
+        return self.tag_index().names()
     
     @property
     def builds(self):
-        results = []
-        if os.path.exists(self.build_root):
-            path_list = os.listdir(self.build_root)
-            for item in os.listdir(self.build_root):
-                path = posixpath.join(self.build_root, item)
-                if os.path.isdir(path):
-                    match = self._valid_build.match(item)
-                    if match:
-                        results.append(item)
-        
-        results.sort(key=lambda x: int(x.split('rc')[-1]))
-        
-        return results
+        return self.tag_index(builds=True).names()
     
     @property
     def build_tag(self):
-        result = None
-        if self.build_tags:
-            result = self.build_tags[-1]
-        else:
-            result = RepoTag(name="rc0")
-        return result
+        return self.build_tags.latest() or RepoTag(name="rc0")
         
     @property
     def version_tag(self):
-        result = None
-        if self.version_tags:
-            result = self.version_tags[-1]
-        else:
-            result = RepoTag(name="1.0.0")
-        return result
+        return self.version_tags.latest() or RepoTag(name="1.0.0")
     
     @property
     def version_tags(self):
@@ -269,12 +413,45 @@ class Pkg(BasePkg):
                'user': user.dump(),
                'tag': tag.dump(),
                'pkg': self.dump() }
+        if kw.get('stats'):
+            log['stats'] = kw['stats']
+        if kw.get('build'):
+            log['build'] = kw['build']
+        span = timing.current()
+        if span:
+            log['timing'] = span.dump()
         if kw.get('dump',False):
-            with open(posixpath.join(tag.path, self._buildlog),'w') as bfile:
-                json.dump(log, bfile, indent=4)
+            #written through a rename so a buildlog hardlinked from the build is not modified
+            self._dump_json(posixpath.join(kw.get('path') or tag.path, self._buildlog), log)
                 
         return log
     
+    def _dump_json(self, path, data):
+        import fileops
+        with open(path + '.tmp','w') as bfile:
+            json.dump(data, bfile, indent=4)
+        fileops.replace(path + '.tmp', path)
+    
+    def _load_json(self, path):
+        '''
+        None if path does not exist
+        '''
+        if not os.path.exists(path):
+            return None
+        with open(path) as bfile:
+            return json.load(bfile)
+    
+    def create_manifest(self, path, **kw):
+        '''
+        write {relative path: [size, sha1]} of a deployed version to its manifest
+        '''
+        import fileops
+        manifest = fileops.build_manifest(path, workers=kw.get('workers'),
+                                          ignore=fileops.ignore_names(path, [self._buildlog, self._manifest,
+                                                                             self._release_notes]))
+        self._dump_json(posixpath.join(path, self._manifest), manifest)
+        return manifest
+    
     
     def create_release_notes(self, build_log, **kw):
         """
@@ -283,8 +460,11 @@ class Pkg(BasePkg):
         notes += "Notes: \n{}\n\n".format(kw.get('notes'))
         path = os.path.join(self.deploy_root)
         if self.root != 'cfg':
-            path = os.path.join(self.deploy_root, self.version)
-        with open(posixpath.join(tag.path, self._release_notes),'w') as bfile:
+            path = os.path.join(self.deploy_root, kw.get('version') or self.version)
+        if not os.path.isdir(path):
+            #packed-only version
+            path = self.deploy_root
+        with open(posixpath.join(path, self._release_notes),'w') as bfile:
                 notes += pp(build_log)
                 bfile.write(notes)
                 
@@ -292,47 +472,422 @@ class Pkg(BasePkg):
             log_name = self._release_notes
             
             
+    def _copy_kw(self, kw):
+        '''
+        CopyEngine options passed through build/deploy/publish
+        workers=<copy threads>
+        progress=<callable(stats)>
+        '''
+        return dict((key, kw[key]) for key in ('workers', 'progress') if kw.get(key) is not None)
+    
+    @timing.timed()
     def build_release(self, **kw):
         '''
         stub w/o unit testing
+        dedup=<'stat' or 'hash': hardlink files unchanged since the previous rc,
+               default GT_BUILD_DEDUP, unset copies everything>
+        the build is written to a staging dir and renamed into place
         '''
-        tag = self._get_next_tag()
+        import fileops
+        timing.annotate(package=self.name)
+        dedup = kw.get('dedup', os.environ.get("GT_BUILD_DEDUP"))
+        index = self.tag_index(builds=True)
+        with timing.span('scan') as span:
+            builds = index.names()
+            fileops.clean_staging(index.root, index.hidden)
+            span.set(tags=len(builds))
+        prev = None
+        if dedup and builds:
+            prev = posixpath.join(self.build_root, builds[-1])
+        #reserved, so no other build gets the same rc
+        with timing.span('reserve'):
+            tag = self.reserve_tag()
         tag.path = posixpath.join(self.build_root, tag.name)
-        if os.path.exists(tag.path) and kw.get('force',None):
-            shutil.rmtree(tag.path)
-        shutil.copytree(self.local_root, tag.path,
-                        ignore=lambda directory, contents: ['.git'] if directory == self.local_root else [])
-        return self.create_build_log(tag=tag, dump=True)
+        staging = fileops.staging_path(tag.path)
+        try:
+            with timing.span('copy') as span:
+                stats = fileops.link_copy_tree(self.local_root, staging, prev=prev, compare=dedup,
+                                               ignore=fileops.ignore_names(self.local_root, self._build_ignore),
+                                               **self._copy_kw(kw))
+                span.set(files=stats['files'], bytes=stats['bytes'])
+            build_log = self.create_build_log(tag=tag, stats=stats, dump=True, path=staging)
+            with timing.span('swap'):
+                fileops.swap_in(staging, tag.path)
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+        index.add(tag.name, tag.commit)
+        self._catalog('record_tag', 'build', build_log)
+        return build_log
        
+    @timing.timed()
     def deploy_release(self,release,**kw):
         '''
         stub copy package from build root to deploy root
+        compile=<precompile .py files in the deployed version, default GT_DEPLOY_COMPILE>
+        compile_workers=<compile processes, default cpu count>
+        pack=<'zip' or 'tar': also write a packed artifact <version>.<pack>, default GT_DEPLOY_PACK>
+        pack_only=<keep only the packed artifact, not the loose tree>
+        the version is assembled in a staging dir next to it and renamed into
+        place once complete, readers never see a partial version
         '''
-        #whatever branch you're on just put it on network
-        #leave it to user to update repo
-        deploy_ignore = ['.git','.pyc','.gitignore']
-        build_log = self.build_release()
+        import fileops
+        import pack
+        timing.annotate(package=self.name)
+        build_log = self.build_release(**self._copy_kw(kw))
         build_tag = RepoTag(**build_log['tag'])
-        tag = self._get_next_tag(release)
-        tag.commit = build_tag.commit
-        tag.path = posixpath.join(self.deploy_root, tag.name).replace('\\','/')
-        self.version = tag.name
+        with timing.span('reserve'):
+            tag = self.reserve_tag(release)
+        published = self.version
+        try:
+            tag.commit = build_tag.commit
+            tag.path = posixpath.join(self.deploy_root, tag.name).replace('\\','/')
+            self.version = tag.name
         
-        if os.path.exists(tag.path) and kw.get('force',False):
-            shutil.rmtree(tag.path)
-        shutil.copytree(build_tag.path, tag.path,
-                        ignore=lambda directory, contents: deploy_ignore if directory == build_tag.path else [])
+            index = self.tag_index()
+            with timing.span('scan') as span:
+                span.set(tags=len(index.names()))
+                fileops.clean_staging(index.root, index.hidden)
+            fmt = kw.get('pack', os.environ.get("GT_DEPLOY_PACK"))
+            #the build is immutable: link it into staging (or copy across filesystems)
+            staging = fileops.staging_path(tag.path)
+            packing = None
+            try:
+                with timing.span('deploy') as span:
+                    stats = fileops.deploy_tree(build_tag.path, staging,
+                                                ignore=fileops.ignore_names(build_tag.path, self._deploy_ignore),
+                                                **self._copy_kw(kw))
+                    span.set(files=stats['files'], bytes=stats['bytes'])
+                if kw.get('compile', os.environ.get("GT_DEPLOY_COMPILE", "False") == "True"):
+                    import bytecode
+                    with timing.span('compile') as span:
+                        stats['compile'] = bytecode.compile_tree(staging, workers=kw.get('compile_workers'),
+                                                                 display_root=tag.path)
+                        span.set(files=stats['compile']['files'])
+                with timing.span('manifest'):
+                    self.create_manifest(staging, **self._copy_kw(kw))
+                build_log = self.create_build_log(tag=tag, stats=stats, build=build_tag.name,
+                                                  dump=True, path=staging)
+                if fmt:
+                    archive = pack.archive_path(self.deploy_root, tag.name, fmt)
+                    #packed aside too, the archive alone lists as the version
+                    packing = fileops.staging_path(archive)
+                    os.makedirs(packing)
+                    packed = os.path.join(packing, os.path.basename(archive))
+                    with timing.span('pack') as span:
+                        pack_index = pack.pack(staging, packed, fmt)
+                        span.set(files=len(pack_index['files']), bytes=pack_index['bytes'])
+                    stats['pack'] = dict((k, v) for k, v in pack_index.items() if k != 'files')
+                    if kw.get('pack_only',False):
+                        tag.path = archive
+                    build_log = self.create_build_log(tag=tag, stats=stats, build=build_tag.name, path=staging,
+                                                      dump=not kw.get('pack_only',False))
+                    pack_index['buildlog'] = build_log
+                    pack.write_index(packed, pack_index)
+                with timing.span('swap'):
+                    if not kw.get('pack_only',False):
+                        fileops.swap_in(staging, tag.path)
+                    if fmt:
+                        #the index first, whoever finds the archive finds its index
+                        fileops.replace(pack.index_path(packed), pack.index_path(archive))
+                        fileops.replace(packed, archive)
+            finally:
+                for path in (staging, packing):
+                    if path and os.path.exists(path):
+                        shutil.rmtree(path, ignore_errors=True)
+        except BaseException:
+            #nothing reached the deploy root, the next deploy can have the number
+            self.version = published
+            self.release_tag(tag, release)
+            raise
+        self._reserved.pop(tag.name, None)
+        index.add(tag.name, tag.commit, path=tag.path)
+        self._catalog('record_tag', 'version', build_log)
         
-        return self.create_build_log(tag=tag, dump=True)
+        return build_log
     
+    def _catalog(self, method, *args):
+        '''
+        update the release catalog, a catalog error never fails the action
+        '''
+        import catalog
+        if not catalog.default_path():
+            return
+        try:
+            getattr(catalog.Catalog(), method)(self.name, *args)
+        except Exception as err:
+            LOG.warning("[{}] catalog {} failed >> {}".format(self.name, method, err))
+    
+    def _read_build_log(self, path):
+        '''
+        build log of a tag directory or packed tag, None if it has none
+        '''
+        import pack
+        if path.endswith(pack.suffixes):
+            return (pack.read_index(path) or {}).get('buildlog')
+        return self._load_json(os.path.join(path, self._buildlog))
+    
+    @timing.timed()
+    def gc(self, **kw):
+        '''
+        remove old rc builds from the build root
+        a build is kept if it is one of the last <keep>, if a deployed version
+        was made from it (build name or commit in its build log) or, with
+        max_age, if it is younger than max_age days
+        keep=<builds to keep, default GT_GC_KEEP or 10>
+        max_age=<days, default GT_GC_MAX_AGE, unset ignores age>
+        dry_run=<only report what would be removed>
+        workers=<parallel deletes, default GT_COPY_WORKERS or 8>
+        returns {'builds', 'kept', 'removed', 'bytes', 'seconds', 'dry_run', 'failed'}
+        '''
+        import fileops
+        start = time.time()
+        keep = kw.get('keep')
+        keep = int(os.environ.get("GT_GC_KEEP", 10) if keep is None else keep)
+        max_age = kw.get('max_age', os.environ.get("GT_GC_MAX_AGE"))
+        dry_run = kw.get('dry_run', False)
+        
+        index = self.tag_index()
+        names = set()
+        commits = set()
+        for version, path in index.items():
+            build_log = self._read_build_log(path) or {}
+            names.add(build_log.get('build'))
+            commits.add(build_log.get('tag', {}).get('commit'))
+        commits.discard(None)
+        
+        #names and paths from the build root, the tags of a RepoPkg have no path
+        index = self.tag_index(builds=True)
+        builds = index.items()
+        candidates = []
+        for name, path in builds[:max(0, len(builds) - keep)]:
+            if name in names:
+                continue
+            if index.has_commit(name):
+                commit = index.get_commit(name)
+            else:
+                commit = (self._read_build_log(path) or {}).get('tag', {}).get('commit')
+            if commit in commits:
+                continue
+            if max_age and time.time() - os.path.getmtime(path) < float(max_age) * 86400:
+                continue
+            candidates.append((name, path))
+        
+        paths = [path for name, path in candidates]
+        failed = {}
+        if dry_run:
+            reclaimed = fileops.tree_usage(paths, workers=kw.get('workers'))
+        else:
+            #renamed aside first so readers never see a half deleted build
+            trash = []
+            for path in paths:
+                try:
+                    os.rename(path, fileops.trash_path(path))
+                    trash.append(fileops.trash_path(path))
+                except OSError as err:
+                    failed[path] = str(err)
+            reclaimed = fileops.tree_usage(trash, workers=kw.get('workers'))
+            #leftover trash is cleaned up like staging dirs on a later build
+            leftover = fileops.remove_trees(trash, workers=kw.get('workers'))
+            failed.update(leftover)
+            reclaimed = max(0, reclaimed - fileops.tree_usage(leftover, workers=kw.get('workers')))
+        removed = [name for name, path in candidates if path not in failed]
+        if not dry_run:
+            self._catalog('remove_tags', 'build', removed)
+        LOG.info("[{}] gc {} {} of {} builds, {} bytes".format(self.name, "would remove" if dry_run else "removed",
+                                                              len(removed), len(builds), reclaimed))
+        return {'builds': len(builds), 'kept': len(builds) - len(removed), 'removed': removed,
+                'bytes': reclaimed, 'seconds': time.time() - start, 'dry_run': dry_run, 'failed': failed}
+    
+    def _phase_history(self, logs):
+        '''
+        {phase: {'runs', 'seconds', 'bytes', 'files'}} from the timing trees of
+        build logs, a span without its own counters gets the ones of its log
+        '''
+        history = {}
+        for log in logs:
+            stats = log.get('stats') or {}
+            run = {}
+            spans = list((log.get('timing') or {}).get('children', []))
+            while spans:
+                span = spans.pop(0)
+                if span.get('children') and span['name'] not in self._plan_phases:
+                    #e.g. the nested build_release
+                    spans.extend(span['children'])
+                    continue
+                phase = self._plan_phases.get(span['name'], 'overhead')
+                entry = run.setdefault(phase, {'seconds': 0.0, 'bytes': 0, 'files': 0})
+                entry['seconds'] += span.get('seconds') or 0.0
+                entry['bytes'] += span.get('bytes', stats.get('bytes', 0)) or 0
+                entry['files'] += span.get('files', stats.get('files', 0)) or 0
+            for phase, entry in run.items():
+                total = history.setdefault(phase, {'runs': 0, 'seconds': 0.0, 'bytes': 0, 'files': 0})
+                total['runs'] += 1
+                for key in ('seconds', 'bytes', 'files'):
+                    total[key] += entry[key]
+        return history
     
+    def _plan_publish(self, paths, files, version, workers=None):
+        '''
+        what publishing version would change: the config version, and for a
+        cfg package the files of the live root by its manifest. files of the
+        same size are hashed to tell if they changed
+        '''
+        import fileops
+        publish = {'from': self.version, 'to': version}
+        if self.root != 'cfg':
+            return publish
+        dst = os.environ.get(self._root_map.get(self.root))
+        published = self._load_json(self._published_manifest(dst)) if dst else None
+        paths = fileops.filter_paths(self.local_root, paths, fileops.ignore_names(
+            self.local_root, [self._buildlog, self._manifest, self._release_notes]))
+        if published is None:
+            publish.update(full=True, added=paths, changed=[], removed=[])
+            return publish
+        maybe = [rel for rel in paths if rel in published and published[rel][0] == files[rel][0]]
+        
+        def changed(rel):
+            return rel, fileops.file_hash(os.path.join(self.local_root, rel)) != published[rel][1]
+        
+        same = set(rel for rel, diff in fileops.pmap(changed, maybe, workers) if not diff)
+        publish.update(full=False, added=sorted(set(paths) - set(published)),
+                       changed=sorted(rel for rel in paths if rel in published and rel not in same),
+                       removed=sorted(set(published) - set(paths)))
+        return publish
+    
+    @timing.timed()
+    def plan(self, release='minor', **kw):
+        '''
+        what deploy_release(release) and a publish of it would do, nothing
+        is copied or reserved: the next build/version tags, the files to copy,
+        files and bytes per phase, the change a delta publish would make and
+        a duration estimated from the throughput in the last deployed build logs
+        workers=<scan and hash threads>
+        history=<build logs to learn from, default GT_PLAN_HISTORY or 5>
+        dedup/compile/pack as for build_release/deploy_release
+        returns {'package', 'release', 'build', 'version', 'files', 'phases',
+                 'publish', 'estimate', 'scan_seconds', 'seconds'}, estimate is None
+                 without timed build logs
+        '''
+        import fileops
+        start = time.time()
+        timing.annotate(package=self.name)
+        workers = kw.get('workers')
+        build = self.peek_tag()
+        version = self.peek_tag(release)
+        
+        with timing.span('scan') as span:
+            files = fileops.scan_tree(self.local_root, workers=workers,
+                                      ignore=fileops.ignore_names(self.local_root, self._build_ignore))
+            #the build mirrors local_root, so the deploy rules apply to it directly
+            paths = fileops.filter_paths(self.local_root, sorted(files),
+                                         fileops.ignore_names(self.local_root, self._deploy_ignore))
+            span.set(files=len(files))
+        scan_seconds = time.time() - start
+        
+        def phase(rel_paths, **extra):
+            extra.update(files=len(rel_paths), bytes=sum(files[rel][0] for rel in rel_paths))
+            return extra
+        
+        phases = {'build': phase(sorted(files)),
+                  'deploy': phase(paths, linked=fileops.same_device(self.build_root, self.deploy_root)),
+                  'manifest': phase(paths)}
+        dedup = kw.get('dedup', os.environ.get("GT_BUILD_DEDUP"))
+        builds = self.tag_index(builds=True).names()
+        if dedup and builds:
+            #by size and mtime, as compare='stat' would
+            prev = fileops.scan_tree(self.tag_index(builds=True).path(builds[-1]), workers=workers)
+            unchanged = [rel for rel, (size, mtime) in files.items()
+                         if rel in prev and prev[rel][0] == size and abs(prev[rel][1] - mtime) < 0.001]
+            phases['build']['unchanged'] = len(unchanged)
+            phases['build']['unchanged_bytes'] = sum(files[rel][0] for rel in unchanged)
+        if kw.get('compile', os.environ.get("GT_DEPLOY_COMPILE", "False") == "True"):
+            phases['compile'] = phase([rel for rel in paths if rel.endswith('.py')])
+        fmt = kw.get('pack', os.environ.get("GT_DEPLOY_PACK"))
+        if fmt:
+            phases['pack'] = phase(paths, format=fmt)
+        
+        with timing.span('publish'):
+            publish = self._plan_publish(paths, files, version.name, workers=workers)
+        
+        index = self.tag_index()
+        logs = [self._read_build_log(path) or {} for name, path in
+                index.items()[-int(kw.get('history') or os.environ.get("GT_PLAN_HISTORY", 5)):]]
+        history = self._phase_history([log for log in logs if log.get('timing')])
+        estimate = None
+        if history:
+            estimate = {'runs': max(entry['runs'] for entry in history.values()), 'phases': {}}
+            for name, planned in phases.items():
+                past = history.get(name)
+                if not past or not past['seconds']:
+                    continue
+                #compile cost follows files, the copies and hashing follow bytes. too
+                #little data moved in the past runs to measure a rate is fixed cost
+                key = 'files' if name == 'compile' else 'bytes'
+                if past[key] >= self._plan_sample[key]:
+                    estimate['phases'][name] = planned[key] * past['seconds'] / past[key]
+                else:
+                    estimate['phases'][name] = past['seconds'] / past['runs']
+            if 'overhead' in history:
+                estimate['phases']['overhead'] = history['overhead']['seconds'] / history['overhead']['runs']
+            estimate['seconds'] = sum(estimate['phases'].values())
+        
+        return {'package': self.name, 'release': release, 'build': build.name, 'version': version.name,
+                'files': paths, 'phases': phases, 'publish': publish, 'estimate': estimate,
+                'scan_seconds': scan_seconds, 'seconds': time.time() - start}
+    
+    
+    @timing.timed('publish_cfg')
+    def _publish_cfg(self, version_path, dst, **kw):
+        '''
+        copy a cfg version over the live config root
+        only files that differ from the manifest of this package's currently
+        published version are copied or removed. several cfg packages share
+        the root, so each keeps its own manifest there and only files listed
+        in it are ever removed. a version without a manifest, no published
+        manifest, or force=True copies the whole version over the root.
+        '''
+        import fileops
+        manifest = self._load_json(os.path.join(version_path, self._manifest))
+        published_path = self._published_manifest(dst)
+        published = self._load_json(published_path)
+        engine = fileops.CopyEngine(**self._copy_kw(kw))
+        if manifest is None or published is None or kw.get('force',False):
+            stats = engine.copy_tree(version_path, dst,
+                                     ignore=fileops.ignore_names(version_path, [self._buildlog, self._manifest]))
+        else:
+            added, changed, removed = fileops.diff_manifest(published, manifest)
+            stats = engine.copy_files(version_path, dst, added + changed)
+            fileops.remove_files(dst, removed)
+            stats['files_removed'] = len(removed)
+        
+        if os.path.exists(os.path.join(dst, self._buildlog)):
+            os.remove(os.path.join(dst, self._buildlog))
+        if manifest is not None:
+            self._dump_json(published_path, manifest)
+        elif published is not None:
+            os.remove(published_path)
+        return stats
+    
+    def _published_manifest(self, dst):
+        '''
+        manifest of the version of this package published to the live root dst
+        '''
+        return os.path.join(dst, ".manifest-{}.json".format(self.name))
+    
+    @timing.timed()
     def publish(self, version, **kw):
         '''
         update targeted config 
+        cfg_batch=<PkgCfgBatch to collect the config update in, the caller commits it.
+                   default writes the config immediately>
         '''
+        import pack
         remote_brk()
+        timing.annotate(package=self.name, version=version)
         
-        version_path = os.path.join(self.deploy_root,version)
+        version_path = self.tag_index().path(version)
+        packed = version_path.endswith(pack.suffixes)
         if not os.path.exists(version_path):
             LOG.warn("[{}] [{}] does not exist..".format(self.name, version))
             return
@@ -342,34 +897,36 @@ class Pkg(BasePkg):
             project = 'default'
         
         
-        _cfg_list = gtcfg.cfg.get_configs('pkg')
-        _CfgChain = gtcfg.cfg.CfgChain(cfg_type='pkg', cfg_list=_cfg_list)
-        _PkgCfg = _CfgChain.find_one(value=project)
-        
-        if not _PkgCfg:
-            #creste new one
-            #should validate against shotgun
-            _cfg_list.sort(key=lambda cfg: int(cfg.id))
-            next_cfg_id = int(_cfg_list[-1].id)+1
-            _PkgCfg = gtcfg.cfg.init_cfg({"type":'pkg','id':next_cfg_id,'code':project.lower()})
-        
         try:
-            build_log_path = os.path.join(version_path, self._buildlog)
-            if os.path.exists(build_log_path):    
-                with open(build_log_path) as bfile:
-                    build_log = json.load(build_log_path)
+            with timing.span('release_notes'):
+                build_log = self._read_build_log(version_path)
+                if build_log:
+                    kw['version'] = version
                     self.create_release_notes(build_log,**kw)
             
             if self.root =='cfg':
                 dst = os.environ[self._root_map.get(self.root)]
-                dir_util.copy_tree(version_path, dst)
-                if os.path.exists(os.path.join(dst, self._buildlog)):
-                    os.remove(os.path.join(dst, self._buildlog))
+                if packed:
+                    tmp = tempfile.mkdtemp(prefix='deployer_')
+                    try:
+                        pack.extract(version_path, tmp)
+                        self._publish_cfg(tmp, dst, **kw)
+                    finally:
+                        shutil.rmtree(tmp, ignore_errors=True)
+                else:
+                    self._publish_cfg(version_path, dst, **kw)
             #update config        
             pub_pkg = BasePkg(**self.dump())
             pub_pkg.version = version
-            _PkgCfg.upsert(pub_pkg.dump())
-            _PkgCfg.dump()
+            #loaded only now, so a single publish loads the chain once and right before its commit
+            with timing.span('cfg_load'):
+                cfg_batch = kw.get('cfg_batch') or PkgCfgBatch()
+            with timing.span('cfg_upsert'):
+                cfg_batch.upsert(project, pub_pkg.dump())
+            self._catalog('record_publish', project, version, RepoUser().login)
+            if not kw.get('cfg_batch'):
+                with timing.span('cfg_commit'):
+                    cfg_batch.commit()
             
         except Exception as err:
             raise PkgPublishError(err)
@@ -382,6 +939,25 @@ class RepoPkg(Pkg):
     """
     _required_env = ("GT_REPO_SERVER", "GT_REPO_ROOT")
     def __init__(self, **kw):
+        """
+        lazy=<defer clone/fetch until a method needs the repo>
+        fetch_ttl=<seconds a previous fetch stays fresh, default GT_REPO_FETCH_TTL or 60>
+        depth=<shallow clone/fetch depth, default GT_REPO_DEPTH, unset is full history>
+        filter=<partial clone filter e.g. blob:none, default GT_REPO_FILTER>
+        sparse=<paths to check out, default GT_REPO_SPARSE (comma separated)>
+        cache=<machine wide object cache dir clones borrow from, default GT_REPO_CACHE,
+               it holds full history so depth does not limit what it downloads>
+        """
+        import gitcmd
+        lazy = kw.pop('lazy', os.environ.get("GT_REPO_LAZY", "False") == "True")
+        self.fetch_ttl = float(kw.pop('fetch_ttl', os.environ.get("GT_REPO_FETCH_TTL", 60)))
+        self.depth = int(kw.pop('depth', os.environ.get("GT_REPO_DEPTH", 0)) or 0)
+        self.filter = kw.pop('filter', os.environ.get("GT_REPO_FILTER")) or None
+        sparse = kw.pop('sparse', os.environ.get("GT_REPO_SPARSE"))
+        if isinstance(sparse, basestring):
+            sparse = [p.strip() for p in sparse.split(',') if p.strip()]
+        self.sparse = sparse or None
+        self.cache = kw.pop('cache', os.environ.get("GT_REPO_CACHE")) or None
         super(RepoPkg, self).__init__(**kw)
         for evar in RepoPkg._required_env:
             try:
@@ -391,25 +967,18 @@ class RepoPkg(Pkg):
         self.user = RepoUser()
         self._repo_server = os.environ["GT_REPO_SERVER"]
         self._repo_root = os.environ["GT_REPO_ROOT"]
-        self._init_repo()
+        self.git = gitcmd.Git(cwd=self.local_root)
+        self._repo_ready = False
+        if not lazy:
+            self._init_repo()
             
     def _init_git(self, **kw):
         """
-        attempt to run a git status to see if git is installed
+        attempt to run git to see if it is installed, checked once per process
         """
+        import gitcmd
         try:
-            proc = subprocess.Popen("git", shell=True, stderr=subprocess.PIPE,
-                                    stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            msg = "[git]: \n"
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status and err:
-                msg += " "+str(err)+"\n"
-                raise Exception(msg)
+            gitcmd.check_installed()
         except Exception as e:
     
             sys.stderr.write(str(e))
@@ -418,6 +987,7 @@ class RepoPkg(Pkg):
     def _init_origin(self):
         pass
     
+    @timing.timed('init_repo')
     def _init_repo(self, **kw):
         """
         assumes git is installed on system and ssh key is present
@@ -435,126 +1005,101 @@ class RepoPkg(Pkg):
                 self.clone()
             elif not self._is_repo():
                 if kw.get('force',False):
-                    shutil.rmtree(local_repo_path)
+                    shutil.rmtree(self.local_root)
                     self.clone()
                 else:
                     raise Exception("[{}] is not a valid repo!\n".format(self.local_root))
             else:
                 self.fetch_changes()
+            self._repo_ready = True
         
         except Exception as err:
             raise RepoPkgInitError(err)
+
+    def _ensure_repo(self):
+        """
+        run the deferred _init_repo of a lazy RepoPkg
+        """
+        if not self._repo_ready:
+            self._init_repo()
         
     def _is_repo(self, **kw):
         """
         """
         try:
-            result = True
-            msg = "[git status]: \n"
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git status",
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                result = False
-                
-        except Exception:
-            sys.stderr.write(msg)
+            result = self.git.run("status", check=False)
+        except Exception as e:
+            sys.stderr.write(str(e))
             raise
     
-        return result
+        return not result.returncode
     
     def _is_dev_repo(self, **kw):
         '''
-        log in to git server and return a list of repo names
+        list the repo names on the git server, through a pooled connection
+        and cached for GT_REPO_LIST_TTL seconds, see ssh.list_repos
+        force=<skip the cache>
         '''
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        import ssh
         try:
-            try:
-                client.connect(self._repo_server, username=self.user.login, password='', key_filename=self.user.ssh_key)
-            except (paramiko.AuthenticationException,paramiko.SSHException) as message:
-                raise Exception("[{}] >> ".format(self._repo_server, message))
-            (stdin, stdout, ssh_stderr) = client.exec_command("ls {} | grep .git | cut -d '.' -f 1 ").format(self._repo_root)
-            results = [l.rstrip() for l in stdout.readlines()]
-            stdin.flush()
-            client.close()
-        except Exception as err:
+            return ssh.list_repos(self._repo_server, self._repo_root, force=kw.get('force', False),
+                                  user=self.user.login, password='', key_filename=self.user.ssh_key)
+        except (ssh.SSHError, Exception) as err:
             raise PkgServerError("[{}] >> {}".format(self._repo_server,err))
-
-        return results
+    
+    def repo_exists(self, **kw):
+        '''
+        True if the package has a repo on the git server
+        via=<'list': the cached server listing (default GT_REPO_LIST_VIA),
+             'git': a local `git ls-remote` of server_root, no server login>
+        '''
+        if kw.get('via', os.environ.get("GT_REPO_LIST_VIA", "list")) == 'git':
+            import ssh
+            return ssh.repo_exists(self.server_root, timeout=kw.get('timeout'))
+        return self.name in self._is_dev_repo(**kw)
     
     def _get_tag_commit(self, tag, **kw):
         '''
+        peel the tag to its commit through the persistent cat-file process
         '''
-        commit_id = None
         try:
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git rev-list -1 "+tag.id,
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            msg = "[git rev-list -1]: \n"
-            commit_id = out.split("\n")[0]
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                raise Exception(msg)
+            commit_id, obj_type, size, content = self.git.cat_file(tag.id + "^{commit}")
+            if obj_type != 'commit':
+                raise Exception("[git cat-file]: {} does not resolve to a commit".format(tag.id))
             tag.commit = commit_id
         except Exception as e:
             msg = "Unable to access [{}]: >> {}".format(self.name,e)
             sys.stderr.write(msg)
             raise e
     
+    @timing.timed('tags')
     def _get_tags(self, builds=False,force=False):
+        self._ensure_repo()
         if not os.path.exists(self.local_root):
-            return
+            return TagTable(builds=builds)
         results = []
         try:
             if builds:
-                #tag_regx = re.compile(r"^rc\d+?$")
-                tag_regx = re.compile(r"^(\S+?)\s+\S+/(rc\d+)$")
+                tag_regx = re.compile(r"^rc\d+$")
                 if self._build_tags and not force:
                     return self._build_tags
             else:
                 if self._version_tags and not force:
                     return self._version_tags
-                #tag_regx = re.compile(r"^\d+?.\d+?.\d+?$")
-                tag_regx = re.compile(r"^(\S+)\s+\S+/(\d+?\.\d+?\.\d+?)$")
-            proc = subprocess.Popen("git ls-remote --tags {}".format(self.server_root),
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            tags = out.split("\n")
-            for tag_ref in tags:
-                #tag = tag_ref.split("/")[-1]
-                match = tag_regx.match(tag_ref)
-                if match:
-                    tag = RepoTag(**{'name': match.group(2), 'id': match.group(1)})
-                    self._get_tag_commit(tag, **kw)
-                    results.append(tag)
-            msg = "[git tag]: \n"
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                raise Exception(msg)
+                tag_regx = re.compile(r"^\d+?\.\d+?\.\d+?$")
+            #one ls-remote + one cat-file pass instead of a rev-list per tag
+            refs = self.git.ls_remote_tags(self.server_root)
+            refs = dict((name, ref) for name, ref in refs.items() if tag_regx.match(name))
+            commits = self.git.resolve_tag_commits(refs, missing_as_commit=bool(
+                self.depth or self.filter or self.git.is_shallow()))
+            for name, (tag_id, peeled) in refs.items():
+                tag = RepoTag(**{'name': name, 'id': tag_id or peeled,
+                                 'commit': commits.get(name)})
+                if not tag.commit:
+                    self._get_tag_commit(tag)
+                results.append(tag)
             
-            results.sort(key=lambda t: [int(u) for u in t.id.split('.')])
+            results = TagTable(results, builds=builds)
             
             if builds:
                 self._build_tags = results
@@ -567,73 +1112,59 @@ class RepoPkg(Pkg):
             sys.stderr.write(msg)
             raise e
            
+    @timing.timed('fetch')
     def fetch_changes(self, **kw):
+        """
+        force=<fetch even if the last fetch is within fetch_ttl>
+        timeout=<seconds before the fetch is killed>
+        returns True if it fetched
+        """
         try:
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git fetch --all --tags",
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            msg = "[git fetch]: "
-            if err:
-                result=True
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                raise Exception
+            age = self.git.fetch_age()
+            if not kw.get('force', False) and age is not None and age < self.fetch_ttl:
+                LOG.debug("[{}] fetched {:.0f}s ago, skipping fetch".format(self.name, age))
+                return False
+            args = ["fetch", "--all", "--tags"]
+            if self.depth or self.git.is_shallow():
+                #without --depth new tags would pull in their whole history
+                args += ["--depth", str(self.depth or 1)]
+            self.git.run(*args, timeout=kw.get('timeout'))
+            self.git.reset()
+            return True
         
         except Exception as e:
             sys.stderr.write(str(e))
             raise e
         
+    @timing.timed()
     def clone(self, **kw):
         '''
+        depth, filter, sparse and cache override the package settings
         '''
+        import gitcmd
         path = kw.get('path', os.path.dirname(self.local_root))
         branch = kw.get('branch', None) or self.current_branch
+        cache = kw.get('cache', self.cache)
         
         try:
-            os.chdir(path)
-            server_path = self.server_root
-            cmd = "git clone -b {} {}".format(branch, self.server_root)
-            if not branch or branch == 'master':
-                cmd = "git clone {}".format(self.server_root)
-            proc =subprocess.Popen(cmd,
-                shell=True,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE)
-            err, out = proc.communicate()
-            exit_status = proc.returncode
-            msg= "[git clone]: \n"
-            if err:
-                msg+=err
-            if out:
-                msg+=out
-            if exit_status:
-                raise Exception(msg)
+            reference = None
+            if cache:
+                reference = gitcmd.update_cache(cache, self.name, self.server_root)
+            self.git.clone(self.server_root, os.path.join(path, self.name),
+                           branch=branch if branch != 'master' else None,
+                           depth=kw.get('depth', self.depth),
+                           filter=kw.get('filter', self.filter),
+                           sparse=kw.get('sparse', self.sparse),
+                           reference=reference)
         except Exception as e:
             sys.stderr.write(str(e))
             raise e
         
+    @timing.timed('push')
     def push_changes(self, **kw):
         try:
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git push -f origin --tags --quiet",
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            err, out = proc.communicate()
-            exit_status = proc.returncode
-            msg = "[git push]: \n"
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                raise Exception(msg)
+            self._ensure_repo()
+            self.git.run("push", "-f", "origin", "--tags", "--quiet")
         except Exception as e:
             sys.stderr.write(str(e))
             raise e
@@ -642,20 +1173,8 @@ class RepoPkg(Pkg):
         '''
         '''
         try:
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git add .",
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            msg = "[git add]: \n"
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                raise Exception(msg)
+            self._ensure_repo()
+            self.git.run("add", ".")
             
         except Exception as e:
             sys.stderr.write(str(e))
@@ -664,30 +1183,25 @@ class RepoPkg(Pkg):
     def commit_changes(self, **kw):
         '''
         '''
+        import gitcmd
         try:
-            self.add(kw)
+            self.stage_changes(**kw)
             message = kw.get('message','auto-commit')
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git commit -am \"{}\" --quiet".format(message),
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            msg = "[git commit]: \n"
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
+            result = self.git.run("commit", "-am", message, "--quiet", check=False)
+            msg = result.err + result.out
+            if result.returncode:
                 if "git push" in msg or "up-to-date" in msg or "nothing to commit" in msg:
                     pass
                 else:
-                    raise Exception(msg)
+                    raise gitcmd.GitCmdError(result)
         except Exception as e:
             sys.stderr.write(str(e))
             raise e
             
+    def build_release(self, **kw):
+        self._ensure_repo()
+        return super(RepoPkg, self).build_release(**kw)
+
     def create_version(self,release_type="minor"):
         '''
         tag current commit
@@ -701,57 +1215,35 @@ class RepoPkg(Pkg):
 
     @property
     def server_root(self):
+        #a url server (file://, https://) takes a path, anything else is ssh host:path
+        if '://' in self._repo_server:
+            return "{}{}.git".format(self._repo_server, posixpath.join('/', self._repo_root, self.name))
         return "{}:{}.git".format(self._repo_server,posixpath.join(self._repo_root,self.name))
 
     @property
     def current_branch(self):
         if not os.path.exists(self.local_root):
             return 'master'
-        result = None
-        msg = "[git status -s -b]: \n"
         try:
-            os.chdir(self.local_root)
-            proc = subprocess.Popen("git status -s -b",
-                                  shell=True,
-                                  stderr=subprocess.PIPE,
-                                  stdout=subprocess.PIPE)
-            out, err = proc.communicate()
-            exit_status = proc.returncode
-            if err:
-                msg += err
-            if out:
-                msg += out
-            if exit_status:
-                raise Exception
-            regex = re.compile(r"^## (.+)\b")
-            match = regex.search(out.split("...")[0])
-            if match:
-                result = match.group(1).split(" ")[-1]
-
-        except Exception:
-            sys.stderr.write(msg)
+            return self.git.current_branch()
+        except Exception as e:
+            sys.stderr.write(str(e))
             raise
-    
-        return result
 
 
-def get_repo_packages():
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+def get_repo_packages(**kw):
+    '''
+    repo names on the git server, pooled and cached like RepoPkg._is_dev_repo
+    '''
+    import ssh
     user = RepoUser()
     repo_root = "repos"
-    results = []
     try:
-        client.connect("git-server", username=user.login, password='jmistrot', key_filename=user.ssh_key)
-        (stdin, stdout, ssh_stderr) = client.exec_command("ls "+repo_root+" | grep .git | cut -d '.' -f 1 ")
-        results = [l.rstrip() for l in stdout.readlines()]
-        stdin.flush()
-        client.close()
-    except (paramiko.AuthenticationException,paramiko.SSHException) as message:
+        return ssh.list_repos("git-server", repo_root, force=kw.get('force', False),
+                              user=user.login, password='jmistrot', key_filename=user.ssh_key)
+    except ssh.SSHError as message:
         raise Exception("[{}] >> {} ".format("git-server", message))
 
-    return results
-
 
 def unittest():
     '''
@@ -781,4 +1273,4 @@ def unittest():
     
 if __name__ == '__main__':
     unittest()
-    
\ No newline at end of file
+    
\ No newline at end of file
@@ -0,0 +1,89 @@
+'''
+fetch and check many package repos at once
+'''
+import os
+import re
+import time
+import logging
+from multiprocessing.pool import ThreadPool
+
+import util
+
+LOG = logging.getLogger(__name__)
+
+_branch_regx = re.compile(r"^## (?:No commits yet on |Initial commit on )?(.+?)(?:\.\.\.(\S+))?(?: \[(.*)\])?$")
+_count_regx = re.compile(r"(ahead|behind) (\d+)")
+
+
+def parse_status(output):
+    '''
+    parse `git status --porcelain --branch` output
+    returns {'branch', 'upstream', 'ahead', 'behind', 'changes'}, branch is None when detached
+    '''
+    result = {'branch': None, 'upstream': None, 'ahead': 0, 'behind': 0, 'changes': 0}
+    for line in output.splitlines():
+        if line.startswith('## '):
+            match = _branch_regx.match(line)
+            if match:
+                branch, upstream, counts = match.groups()
+                result['branch'] = None if branch.startswith('HEAD (no branch)') else branch
+                result['upstream'] = upstream
+                for key, count in _count_regx.findall(counts or ''):
+                    result[key] = int(count)
+        elif line.strip():
+            result['changes'] += 1
+    return result
+
+
+def refresh_one(pkg, fetch=True, force=False, timeout=None):
+    '''
+    fetch (honouring the package fetch_ttl unless force) and read the
+    branch/status of one RepoPkg, never raises
+    timeout=<seconds each git call may take>
+    '''
+    report = {'package': pkg.name, 'fetched': False, 'status': 'ok', 'error': None}
+    report.update(parse_status(''))
+    start = time.time()
+    try:
+        if not os.path.isdir(os.path.join(pkg.local_root, '.git')):
+            report['status'] = 'missing'
+        else:
+            if fetch:
+                report['fetched'] = pkg.fetch_changes(force=force, timeout=timeout)
+            report.update(parse_status(pkg.git.run("status", "--porcelain", "--branch", timeout=timeout).out))
+    except BaseException as err:
+        LOG.debug("[{}] refresh failed".format(pkg.name), exc_info=True)
+        report['status'] = 'failed'
+        report['error'] = " ".join(str(err).split())
+    report['seconds'] = time.time() - start
+    return report
+
+
+def refresh(pkgs, workers=16, **kw):
+    '''
+    refresh_one every pkg on a bounded thread pool, the git calls are
+    subprocesses so up to workers repos wait on the network at once
+    kw are passed to refresh_one
+    returns the reports in pkgs order
+    '''
+    if not pkgs:
+        return []
+    pool = ThreadPool(max(1, min(workers, len(pkgs))))
+    try:
+        reports = pool.map(lambda pkg: refresh_one(pkg, **kw), pkgs, chunksize=1)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return reports
+
+
+def format_report(reports):
+    rows = [("package", "branch", "fetched", "ahead", "behind", "changes", "status", "seconds", "error")]
+    for report in reports:
+        rows.append((report['package'], report['branch'] or '', "yes" if report['fetched'] else "no",
+                     report['ahead'], report['behind'], report['changes'], report['status'],
+                     "{:.2f}".format(report['seconds']), report['error'] or ''))
+    return util.format_columns(rows)
@@ -0,0 +1,193 @@
+'''
+pooled ssh command transports for the git server, plus a cached repo listing
+'''
+import os
+import time
+import atexit
+import logging
+import tempfile
+import threading
+import subprocess
+
+import gitcmd
+
+LOG = logging.getLogger(__name__)
+
+_pool = {}
+_pool_lock = threading.Lock()
+_listings = {}
+_paramiko = []
+
+
+def _import_paramiko():
+    '''
+    paramiko module or None, imported on first use, it is slow to import
+    '''
+    if not _paramiko:
+        try:
+            import paramiko
+        except ImportError:
+            paramiko = None
+        _paramiko.append(paramiko)
+    return _paramiko[0]
+
+
+class SSHError(BaseException):
+    pass
+
+
+class _ParamikoTransport(object):
+    '''
+    one connected SSHClient, commands run as channels on its transport
+    '''
+    def __init__(self, host, user=None, key_filename=None, password=None):
+        self.host = host
+        self.user = user
+        self.key_filename = key_filename
+        self.password = password
+        self.client = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            transport = self.client.get_transport() if self.client else None
+            if not transport or not transport.is_active():
+                paramiko = _import_paramiko()
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                try:
+                    client.connect(self.host, username=self.user, password=self.password,
+                                   key_filename=self.key_filename)
+                except (paramiko.AuthenticationException, paramiko.SSHException) as message:
+                    raise SSHError("[{}] >> {}".format(self.host, message))
+                self.client = client
+            return self.client
+
+    def run(self, command, timeout=None):
+        stdin, stdout, stderr = self._connect().exec_command(command, timeout=timeout)
+        out = stdout.read()
+        if stdout.channel.recv_exit_status():
+            raise SSHError("[{}] {} >> {}".format(self.host, command, stderr.read().strip()))
+        return out
+
+    def close(self):
+        with self._lock:
+            if self.client:
+                self.client.close()
+                self.client = None
+
+
+class _OpenSSHTransport(object):
+    '''
+    the ssh binary with a ControlMaster socket kept alive for GT_SSH_PERSIST
+    seconds, so only the first command pays for the handshake
+    '''
+    def __init__(self, host, user=None, key_filename=None, password=None):
+        self.host = host
+        self.user = user
+        self.key_filename = key_filename
+        control_dir = os.environ.get("GT_SSH_CONTROL_DIR") or tempfile.gettempdir()
+        self.options = ["-o", "BatchMode=yes",
+                        "-o", "ControlMaster=auto",
+                        "-o", "ControlPath={}".format(os.path.join(control_dir, "gt-ssh-%r@%h:%p")),
+                        "-o", "ControlPersist={}".format(os.environ.get("GT_SSH_PERSIST", "300"))]
+        if key_filename:
+            self.options += ["-i", key_filename]
+
+    def _target(self):
+        return "{}@{}".format(self.user, self.host) if self.user else self.host
+
+    def run(self, command, timeout=None):
+        options = list(self.options)
+        if timeout:
+            options += ["-o", "ConnectTimeout={}".format(int(timeout))]
+        proc = subprocess.Popen(["ssh"] + options + [self._target(), command],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode:
+            raise SSHError("[{}] {} >> {}".format(self.host, command, err.strip()))
+        return out
+
+    def close(self):
+        subprocess.call(["ssh"] + self.options + ["-O", "exit", self._target()],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+class _LocalTransport(object):
+    '''
+    runs commands on this machine, a stand-in for the git server in tests
+    '''
+    def __init__(self, host, user=None, key_filename=None, password=None):
+        self.host = host
+
+    def run(self, command, timeout=None):
+        proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        if proc.returncode:
+            raise SSHError("[{}] {} >> {}".format(self.host, command, err.strip()))
+        return out
+
+    def close(self):
+        pass
+
+
+_backends = {'paramiko': _ParamikoTransport, 'openssh': _OpenSSHTransport, 'local': _LocalTransport}
+
+
+def transport(host, user=None, key_filename=None, password=None, backend=None):
+    '''
+    pooled transport for host and user, created on first use
+    backend=<'paramiko', 'openssh' or 'local', default GT_SSH_BACKEND,
+             else paramiko when it is installed, else openssh>
+    '''
+    backend = backend or os.environ.get("GT_SSH_BACKEND") or ('paramiko' if _import_paramiko() else 'openssh')
+    if backend not in _backends:
+        raise SSHError("Unknown ssh backend [{}], expected one of {}".format(backend, sorted(_backends)))
+    if backend == 'paramiko' and not _import_paramiko():
+        raise SSHError("paramiko is not installed, set GT_SSH_BACKEND=openssh")
+    key = (backend, host, user, key_filename)
+    with _pool_lock:
+        if key not in _pool:
+            _pool[key] = _backends[backend](host, user=user, key_filename=key_filename, password=password)
+        return _pool[key]
+
+
+def close_all():
+    with _pool_lock:
+        for conn in _pool.values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _pool.clear()
+
+atexit.register(close_all)
+
+
+def list_repos(host, root, ttl=None, force=False, **kw):
+    '''
+    names of the <name>.git repos in root on host, cached for ttl seconds
+    ttl=<default GT_REPO_LIST_TTL or 300>
+    force=<ignore the cache>
+    kw are passed to transport
+    '''
+    ttl = float(os.environ.get("GT_REPO_LIST_TTL", 300) if ttl is None else ttl)
+    key = (host, root, kw.get('user'))
+    cached = _listings.get(key)
+    if cached and not force and time.time() - cached[0] < ttl:
+        return list(cached[1])
+    start = time.time()
+    out = transport(host, **kw).run("ls -1 {}".format(root))
+    names = sorted(name[:-len('.git')] for name in out.split() if name.endswith('.git'))
+    LOG.debug("[{}] listed {} repos in {:.3f}s".format(host, len(names), time.time() - start))
+    _listings[key] = (time.time(), names)
+    return list(names)
+
+
+def repo_exists(url, timeout=None):
+    '''
+    check one repo with a local `git ls-remote`, through the user's own
+    ssh config (and its ControlMaster, if any) instead of a server login
+    '''
+    result = gitcmd.Git().run("ls-remote", "--heads", url, check=False, timeout=timeout)
+    return not result.returncode
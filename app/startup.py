@@ -0,0 +1,78 @@
+'''
+--profile support: cProfile of the whole run plus an import time breakdown
+'''
+import os
+import sys
+import time
+import atexit
+import tempfile
+import __builtin__
+
+
+class ImportTimer(object):
+    '''
+    times the first import of every module by wrapping __import__,
+    py2 has no -X importtime
+    '''
+    def __init__(self):
+        self.times = {}
+        self._stack = []
+        self._import = None
+
+    def _timed_import(self, name, *args, **kw):
+        if name in sys.modules:
+            return self._import(name, *args, **kw)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, *args, **kw)
+        finally:
+            elapsed = time.time() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if name not in self.times:
+                self.times[name] = (elapsed, elapsed - nested)
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+        return self
+
+    def uninstall(self):
+        if self._import:
+            __builtin__.__import__ = self._import
+            self._import = None
+
+    def report(self, limit=25):
+        rows = sorted(self.times.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        lines = ["{:>10} {:>10}  {}".format("cumul ms", "self ms", "module")]
+        lines += ["{:>10.1f} {:>10.1f}  {}".format(cumul * 1000, own * 1000, name) for name, (cumul, own) in rows]
+        return "\n".join(lines)
+
+
+def start(output=None, limit=30):
+    '''
+    profile the rest of the process, the report goes to stderr at exit
+    output=<pstats file, default GT_PROFILE_OUT or deployer-<pid>.prof in the temp dir>
+    '''
+    import cProfile
+    output = output or os.environ.get("GT_PROFILE_OUT") or os.path.join(
+        tempfile.gettempdir(), "deployer-{}.prof".format(os.getpid()))
+    timer = ImportTimer().install()
+    profiler = cProfile.Profile()
+    began = time.time()
+
+    def report():
+        profiler.disable()
+        timer.uninstall()
+        import pstats
+        profiler.dump_stats(output)
+        sys.stderr.write("\n====== profile: {:.3f}s, stats in {} ======\n".format(time.time() - began, output))
+        stats = pstats.Stats(profiler, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(limit)
+        sys.stderr.write("====== imports ======\n{}\n".format(timer.report(limit)))
+
+    atexit.register(report)
+    profiler.enable()
+    return profiler
@@ -0,0 +1,260 @@
+import os
+import re
+import bisect
+import threading
+
+_spec_regx = re.compile(r"^\s*(>=|<=|==|>|<)?\s*(\d+(?:\.\d+){0,2})\s*$")
+
+
+def version_key(name):
+    '''
+    integer sort key of x.y.z, missing parts count as 0
+    '''
+    parts = [int(n) for n in name.split('.')]
+    parts += [0] * (3 - len(parts))
+    return (parts[0] << 40) | (parts[1] << 20) | parts[2]
+
+
+def version_name(key):
+    return "{}.{}.{}".format(key >> 40, (key >> 20) & 0xfffff, key & 0xfffff)
+
+
+def build_key(name):
+    return int(name.split('rc')[-1])
+
+
+def next_name(name, release_type=None):
+    '''
+    tag after name: rcN+1 without release_type, else the bumped x.y.z
+    '''
+    if not release_type:
+        return "rc{}".format(build_key(name) + 1)
+    key = version_key(name)
+    if release_type == 'major':
+        key = ((key >> 40) + 1) << 40
+    elif release_type == 'minor':
+        key = ((key >> 20) + 1) << 20
+    elif release_type == 'bug':
+        key += 1
+    return version_name(key)
+
+
+class TagTable(object):
+    '''
+    tags sorted by a precomputed integer key, lookups are a bisect
+    behaves like the sorted list of tags it holds
+    tags=<objects with a .name>
+    builds=<rcN tags instead of x.y.z>
+    '''
+    __slots__ = ('builds', 'keys', 'tags')
+
+    def __init__(self, tags=(), builds=False):
+        self.builds = builds
+        key = build_key if builds else version_key
+        pairs = sorted(((key(tag.name), tag) for tag in tags), key=lambda pair: pair[0])
+        self.keys = [k for k, tag in pairs]
+        self.tags = [tag for k, tag in pairs]
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __getitem__(self, index):
+        return self.tags[index]
+
+    def _key(self, name):
+        return build_key(name) if self.builds else version_key(name)
+
+    def add(self, tag):
+        key = self._key(tag.name)
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            self.tags[index] = tag
+        else:
+            self.keys.insert(index, key)
+            self.tags.insert(index, tag)
+
+    def find(self, name):
+        key = self._key(name)
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.tags[index]
+        return None
+
+    def latest(self, pattern=None):
+        '''
+        newest tag, or newest matching a version pattern like 1.4.* or 1.*
+        None if there is none
+        '''
+        lo, hi = self._bounds(pattern)
+        index = bisect.bisect_left(self.keys, hi) if hi is not None else len(self.keys)
+        if index and (lo is None or self.keys[index - 1] >= lo):
+            return self.tags[index - 1]
+        return None
+
+    def next(self, release_type=None, default=None):
+        '''
+        name of the tag after latest, see next_name
+        default=<name to bump when the table is empty, rc0 / 1.0.0>
+        '''
+        latest = self.latest()
+        name = latest.name if latest else default or ('rc0' if self.builds else '1.0.0')
+        return next_name(name, release_type)
+
+    def range(self, spec):
+        '''
+        tags matching comma separated bounds, e.g. '>=2.0,<3' or '1.4.*'
+        '''
+        lo, hi = self._bounds(spec)
+        start = bisect.bisect_left(self.keys, lo) if lo is not None else 0
+        end = bisect.bisect_left(self.keys, hi) if hi is not None else len(self.keys)
+        return self.tags[start:end]
+
+    def _bounds(self, spec):
+        '''
+        [lo, hi) key bounds of a spec, None is unbounded
+        '''
+        lo = hi = None
+        for clause in (spec or '').split(','):
+            clause = clause.strip()
+            if not clause or clause == '*':
+                continue
+            if clause.endswith('.*') and not self.builds:
+                parts = [int(n) for n in clause[:-2].split('.')]
+                low = version_key(clause[:-2])
+                high = version_key('.'.join(str(n) for n in parts[:-1] + [parts[-1] + 1]))
+            else:
+                match = _spec_regx.match(clause.replace('rc', '') if self.builds else clause)
+                if not match:
+                    raise ValueError("Invalid tag spec [{}]".format(clause))
+                op, name = match.groups()
+                key = int(name) if self.builds else version_key(name)
+                low, high = {'>=': (key, None), '>': (key + 1, None),
+                             '<': (None, key), '<=': (None, key + 1)}.get(op, (key, key + 1))
+            if low is not None:
+                lo = low if lo is None else max(lo, low)
+            if high is not None:
+                hi = high if hi is None else min(hi, high)
+        return lo, hi
+
+
+
+class TagIndex(object):
+    '''
+    Cached listing of the tag directories (rcNNN / x.y.z) under a root.
+    Packed tags (x.y.z.zip) are listed too when their suffix is given.
+
+    The listing is rebuilt only when the root directory mtime changes or a
+    tag was added, so repeated lookups on a warm index never touch the
+    filesystem beyond a single stat. commits survive a rebuild.
+    root=<directory to index>
+    regex=<compiled regex a tag name must match>
+    sort_key=<callable used to order tag names>
+    packed=<archive suffixes recognised as packed tags, e.g. ('.zip', '.tar')>
+    hidden lists the dot entries (e.g. staging dirs) seen by the last scan
+    '''
+    def __init__(self, root, regex, sort_key, packed=()):
+        self.root = root
+        self.regex = regex
+        self.sort_key = sort_key
+        self.packed = tuple(packed)
+        self.scans = 0
+        self._mtime = None
+        self._names = None
+        self._paths = {}
+        self._commits = {}
+        self.hidden = []
+        self._lock = threading.RLock()
+
+    def _root_mtime(self):
+        try:
+            return os.stat(self.root).st_mtime
+        except OSError:
+            return None
+
+    def _scan(self):
+        paths = {}
+        hidden = []
+        if os.path.isdir(self.root):
+            for item in os.listdir(self.root):
+                if item.startswith('.'):
+                    #staging dirs and other dot entries are never tags
+                    hidden.append(item)
+                    continue
+                path = os.path.join(self.root, item)
+                name, ext = os.path.splitext(item)
+                if ext in self.packed and self.regex.match(name) and os.path.isfile(path):
+                    #a loose tree wins over an archive of the same tag
+                    paths.setdefault(name, path)
+                elif self.regex.match(item) and os.path.isdir(path):
+                    paths[item] = path
+        self.hidden = hidden
+        self.scans += 1
+        return paths
+
+    def names(self):
+        '''
+        sorted tag names, rescanning only if the root has changed
+        '''
+        with self._lock:
+            self._refresh()
+            return list(self._names)
+
+    def _refresh(self):
+        mtime = self._root_mtime()
+        with self._lock:
+            if self._names is None or mtime != self._mtime:
+                self._paths = self._scan()
+                self._names = sorted(self._paths, key=self.sort_key)
+                self._mtime = mtime
+                for name in set(self._commits) - set(self._names):
+                    self._commits.pop(name)
+
+    def items(self):
+        '''
+        sorted [(name, path)], one freshness check for all of them
+        '''
+        with self._lock:
+            self._refresh()
+            return [(name, self._paths[name]) for name in self._names]
+
+    def path(self, name):
+        '''
+        tag directory, or archive for a packed tag
+        '''
+        with self._lock:
+            self._refresh()
+            return self._paths.get(name) or os.path.join(self.root, name)
+
+    def add(self, name, commit=None, path=None):
+        '''
+        record a tag created by this process. its commit is kept, the next
+        lookup rescans: other processes may have changed the root meanwhile
+        and its mtime can't tell their changes from ours
+        '''
+        with self._lock:
+            if self._names is not None and name not in self._names:
+                self._names.append(name)
+                self._names.sort(key=self.sort_key)
+            self._paths[name] = path or os.path.join(self.root, name)
+            self._commits[name] = commit
+            self._mtime = None
+
+    def has_commit(self, name):
+        return name in self._commits
+
+    def get_commit(self, name):
+        return self._commits.get(name)
+
+    def set_commit(self, name, commit):
+        with self._lock:
+            self._commits[name] = commit
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+            self._paths = {}
+            self._mtime = None
+            self._commits.clear()
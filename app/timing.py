@@ -0,0 +1,206 @@
+'''
+lightweight timing spans for deployer phases
+spans nest per thread, the tree of an action is embedded in its build log
+and every finished span can be appended to a JSON-lines event file.
+GT_TIMING=off turns spans into a shared no-op object
+GT_TIMING_EVENTS=<file to append events to, '-' for stderr>
+subscribe() gets the same events in process, e.g. to stream job progress
+'''
+import os
+import sys
+import time
+import functools
+import threading
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+_local = threading.local()
+_events_lock = threading.Lock()
+_listeners = []
+
+
+def enabled():
+    return os.environ.get("GT_TIMING", "on") != "off"
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def subscribe(func):
+    '''
+    call func(event) with every finished span of any thread
+    '''
+    with _events_lock:
+        _listeners.append(func)
+
+
+def unsubscribe(func):
+    with _events_lock:
+        if func in _listeners:
+            _listeners.remove(func)
+
+
+def _emit(span):
+    path = os.environ.get("GT_TIMING_EVENTS")
+    if not path and not _listeners:
+        return
+    event = {'event': 'span', 'name': span.name, 'path': span.path, 'start': span.start,
+             'seconds': span.seconds, 'pid': os.getpid(), 'thread': threading.current_thread().name}
+    #attrs of the enclosing spans, e.g. the package of the action, then its own
+    chain = []
+    parent = span
+    while parent is not None:
+        chain.append(parent.attrs)
+        parent = parent.parent
+    for attrs in reversed(chain):
+        event.update(attrs)
+    for listener in list(_listeners):
+        try:
+            listener(event)
+        except Exception:
+            pass
+    if not path:
+        return
+    line = json.dumps(event, default=str) + "\n"
+    with _events_lock:
+        if path == '-':
+            sys.stderr.write(line)
+        else:
+            with open(path, 'a') as efile:
+                efile.write(line)
+
+
+class Span(object):
+    '''
+    a timed phase, use as a context manager
+    attrs=<counters recorded with it, e.g. files=, bytes=>
+    '''
+    __slots__ = ('name', 'path', 'start', 'seconds', 'attrs', 'children', 'parent')
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.path = name
+        self.parent = None
+        self.start = None
+        self.seconds = None
+        self.attrs = attrs
+        self.children = []
+
+    def __enter__(self):
+        stack = _stack()
+        if stack:
+            stack[-1].children.append(self)
+            self.parent = stack[-1]
+            self.path = stack[-1].path + "/" + self.name
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.time() - self.start
+        if exc[0] is not None:
+            self.attrs['error'] = exc[0].__name__
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        _emit(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def dump(self):
+        '''
+        {'name', 'seconds', <attrs>, 'children'}, an open span reports its time so far
+        '''
+        data = dict(self.attrs)
+        data['name'] = self.name
+        data['seconds'] = self.seconds if self.seconds is not None else time.time() - (self.start or time.time())
+        if self.children:
+            data['children'] = [child.dump() for child in self.children]
+        return data
+
+
+class _NullSpan(object):
+    children = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def set(self, **attrs):
+        return self
+
+    def dump(self):
+        return None
+
+_null = _NullSpan()
+
+
+def span(name, **attrs):
+    '''
+    Span nested under the current one of this thread
+    '''
+    if not enabled():
+        return _null
+    return Span(name, **attrs)
+
+
+def record(name, seconds, **attrs):
+    '''
+    add an already timed phase, e.g. a subprocess, under the current span
+    '''
+    if not enabled():
+        return
+    done = Span(name, **attrs)
+    done.start = time.time() - seconds
+    done.seconds = seconds
+    stack = _stack()
+    if stack:
+        stack[-1].children.append(done)
+        done.parent = stack[-1]
+        done.path = stack[-1].path + "/" + name
+    _emit(done)
+
+
+def current():
+    '''
+    innermost open span of this thread, None if there is none
+    '''
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def annotate(**attrs):
+    '''
+    set attrs on the current span, if any
+    '''
+    stack = _stack()
+    if stack:
+        stack[-1].attrs.update(attrs)
+
+
+def timed(name=None):
+    '''
+    decorator running the function in a span, named after it by default
+    '''
+    def wrap(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            if not enabled():
+                return func(*args, **kw)
+            with Span(label):
+                return func(*args, **kw)
+        return wrapper
+    return wrap
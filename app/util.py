@@ -0,0 +1,19 @@
+'''
+small helpers shared by the deployer modules
+'''
+
+
+def format_columns(rows):
+    '''
+    left aligned text columns, rows are tuples and the first one is the header
+    '''
+    widths = [max(len(str(row[i])) for row in rows) for i in range(len(rows[0]))]
+    return "\n".join("  ".join(str(col).ljust(widths[i]) for i, col in enumerate(row)).rstrip() for row in rows)
+
+
+def queue_get(queue):
+    '''
+    blocking Queue.get that ctrl-c can interrupt, on py2 a get without a
+    timeout does not see KeyboardInterrupt
+    '''
+    return queue.get(True, 1e6)
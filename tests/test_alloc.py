@@ -0,0 +1,58 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+try:
+    import pkg
+except ImportError:
+    #needs gtcfg
+    pkg = None
+
+
+def _builds(count):
+    demo = pkg.Pkg(name='demo')
+    return [demo.build_release()['tag']['name'] for i in range(count)]
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class ConcurrentBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.env = dict(os.environ)
+        for name in ('build', 'dev', 'deploy'):
+            os.environ["GT_{}_ROOT".format(name.upper())] = os.path.join(self.root, name)
+        os.environ["GT_CATALOG"] = 'off'
+        os.environ["GT_TIMING"] = 'off'
+        src = os.path.join(self.root, 'dev', 'demo')
+        os.makedirs(src)
+        with open(os.path.join(src, 'a.py'), 'w') as fobj:
+            fobj.write('A = 1\n')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_concurrent_builds_get_unique_rcs(self):
+        processes, builds = 12, 4
+        pool = multiprocessing.Pool(processes)
+        try:
+            names = sum(pool.map(_builds, [builds] * processes), [])
+            pool.close()
+        finally:
+            pool.join()
+        expected = ['rc{}'.format(i) for i in range(1, processes * builds + 1)]
+        self.assertEqual(sorted(names, key=pkg.tags.build_key), expected)
+        build_root = os.path.join(self.root, 'build', 'demo')
+        on_disk = [name for name in os.listdir(build_root) if not name.startswith('.')]
+        self.assertEqual(sorted(on_disk, key=pkg.tags.build_key), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
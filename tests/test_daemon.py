@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import time
+import stat
+import socket
+import shutil
+import tempfile
+import unittest
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import daemon
+
+try:
+    import pkg
+except ImportError:
+    #needs gtcfg
+    pkg = None
+
+
+def _free_port():
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class DaemonAccessTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.env = dict(os.environ)
+        os.environ["GT_DAEMON_TOKEN_FILE"] = os.path.join(self.root, 'token')
+        os.environ["GT_TIMING"] = 'off'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _serve(self, address):
+        thread = threading.Thread(target=daemon.serve, args=(address, 1))
+        thread.daemon = True
+        thread.start()
+        deadline = time.time() + 10
+        while True:
+            try:
+                return thread, list(daemon.request({'op': 'ping'}, address, timeout=5))
+            except daemon.DaemonError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _stop(self, address, thread):
+        list(daemon.request({'op': 'stop'}, address, timeout=5))
+        thread.join(10)
+
+    def test_tcp_requests_need_the_token(self):
+        address = "127.0.0.1:{}".format(_free_port())
+        thread, events = self._serve(address)
+        try:
+            self.assertEqual(events[0]['event'], 'pong')
+            self.assertEqual(stat.S_IMODE(os.stat(daemon.token_path()).st_mode), 0o600)
+            for token in (None, 'guess'):
+                conn = socket.create_connection(('127.0.0.1', int(address.split(':')[1])), 5)
+                try:
+                    conn.sendall(json.dumps({'op': 'status', 'token': token}) + "\n")
+                    answer = json.loads(conn.makefile('r').readline())
+                finally:
+                    conn.close()
+                self.assertEqual(answer['event'], 'error')
+        finally:
+            self._stop(address, thread)
+        self.assertFalse(os.path.exists(daemon.token_path()))
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), "no unix sockets")
+    def test_unix_socket_is_private_from_the_start(self):
+        address = os.path.join(self.root, 'daemon.sock')
+        umask = os.umask(0o022)
+        try:
+            thread, events = self._serve(address)
+        finally:
+            os.umask(umask)
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(address).st_mode), 0o600)
+        finally:
+            self._stop(address, thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
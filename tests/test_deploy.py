@@ -0,0 +1,81 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import pack
+import fileops
+
+try:
+    import pkg
+except ImportError:
+    #needs gtcfg
+    pkg = None
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class DeployTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.env = dict(os.environ)
+        for name in ('build', 'dev', 'deploy'):
+            os.environ["GT_{}_ROOT".format(name.upper())] = os.path.join(self.root, name)
+        os.environ["GT_CATALOG"] = 'off'
+        os.environ["GT_TIMING"] = 'off'
+        self.src = os.path.join(self.root, 'dev', 'demo')
+        os.makedirs(os.path.join(self.src, 'mod'))
+        self._write('mod/a.py', 'A = 1\n')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _write(self, rel, data):
+        with open(os.path.join(self.src, rel), 'wb') as fobj:
+            fobj.write(data)
+
+    def _read(self, path):
+        with open(path, 'rb') as fobj:
+            return fobj.read()
+
+    def test_compile_leaves_linked_build_files_alone(self):
+        #a stale pyc in the dev tree ends up in the build and linked into staging
+        self._write('mod/a.pyc', 'stale')
+        demo = pkg.Pkg(name='demo')
+        log = demo.deploy_release('minor', compile=True, compile_workers=1)
+        build = os.path.join(demo.build_root, log['build'], 'mod')
+        deploy = os.path.join(log['tag']['path'], 'mod')
+        self.assertEqual(self._read(os.path.join(build, 'a.pyc')), 'stale')
+        self.assertNotEqual(os.stat(os.path.join(build, 'a.pyc')).st_ino,
+                            os.stat(os.path.join(deploy, 'a.pyc')).st_ino)
+        self.assertNotEqual(self._read(os.path.join(deploy, 'a.pyc')), 'stale')
+        self.assertEqual(os.stat(os.path.join(build, 'a.py')).st_ino,
+                         os.stat(os.path.join(deploy, 'a.py')).st_ino)
+
+    def test_failed_swap_leaves_no_archive(self):
+        demo = pkg.Pkg(name='demo')
+        saved = fileops.swap_in
+        def swap_in(staging, target):
+            if target.startswith(demo.deploy_root):
+                raise OSError("swap failed")
+            saved(staging, target)
+        fileops.swap_in = swap_in
+        try:
+            self.assertRaises(OSError, demo.deploy_release, 'minor', pack='zip')
+        finally:
+            fileops.swap_in = saved
+        self.assertEqual(pkg.Pkg(name='demo').versions, [])
+        self.assertEqual([name for name in os.listdir(demo.deploy_root) if not name.startswith('.alloc')], [])
+        version = demo.deploy_release('minor', pack='zip')['tag']['name']
+        self.assertEqual(pkg.Pkg(name='demo').versions, [version])
+        archive = pack.archive_path(demo.deploy_root, version, 'zip')
+        self.assertEqual(pack.read_index(archive)['buildlog']['tag']['name'], version)
+
+
+if __name__ == '__main__':
+    unittest.main()
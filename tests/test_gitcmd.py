@@ -0,0 +1,154 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import alloc
+import gitcmd
+from gitcmd import Git
+
+
+try:
+    import pkg
+except ImportError:
+    #needs gtcfg
+    pkg = None
+
+
+def _commit(repo, name, data):
+    if os.path.dirname(name) and not os.path.isdir(os.path.join(repo, os.path.dirname(name))):
+        os.makedirs(os.path.join(repo, os.path.dirname(name)))
+    with open(os.path.join(repo, name), 'w') as fobj:
+        fobj.write(data)
+    git = Git(repo)
+    git.run("add", name)
+    git.run("-c", "user.name=test", "-c", "user.email=test@localhost", "commit", "--quiet", "-m", name)
+
+
+def _server(root, name):
+    '''
+    bare repo <root>/<name>.git with three commits, files under a/ and b/,
+    served over file:// so depth and filter apply as they would over ssh
+    returns (work tree to push more commits from, url)
+    '''
+    work = os.path.join(root, 'work-' + name)
+    Git().run("init", "--quiet", work)
+    for rel in ('top.txt', 'a/a.txt', 'b/b.txt'):
+        _commit(work, rel, rel)
+    bare = os.path.join(root, name + '.git')
+    Git().run("clone", "--quiet", "--bare", work, bare)
+    Git(bare).run("config", "uploadpack.allowFilter", "true")
+    Git(work).run("remote", "add", "origin", bare)
+    return work, 'file://' + bare
+
+
+class ObjectCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.cache = os.path.join(self.root, 'cache')
+        work = os.path.join(self.root, 'work')
+        Git().run("init", "--quiet", work)
+        _commit(work, 'a.txt', 'a')
+        self.url = os.path.join(self.root, 'demo.git')
+        Git().run("clone", "--quiet", "--bare", work, self.url)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_cache_is_never_gced(self):
+        repo = gitcmd.update_cache(self.cache, 'demo', self.url)
+        git = Git(repo)
+        self.assertEqual(git.run("config", "gc.auto").out.strip(), '0')
+        self.assertEqual(git.run("config", "gc.pruneExpire").out.strip(), 'never')
+        self.assertTrue(git.run("for-each-ref", "refs/cache/demo/").out.strip())
+
+    def test_busy_cache_raises_an_exception(self):
+        with alloc.Counter(self.cache, 'objects').locked():
+            self.assertRaises(gitcmd.GitCacheError, gitcmd.update_cache, self.cache, 'demo', self.url, timeout=0.2)
+
+
+
+class CloneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.work, self.url = _server(self.root, 'demo')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _clone(self, name, **kw):
+        dest = os.path.join(self.root, 'clones', name)
+        if not os.path.isdir(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest))
+        Git().clone(self.url, dest, **kw)
+        return Git(dest)
+
+    def test_depth(self):
+        git = self._clone('shallow', depth=1)
+        self.assertTrue(git.is_shallow())
+        self.assertEqual(git.run("rev-list", "--count", "HEAD").out.strip(), '1')
+        self.assertFalse(self._clone('full').is_shallow())
+
+    def test_filter(self):
+        git = self._clone('partial', filter='blob:none')
+        self.assertEqual(git.run("config", "remote.origin.partialclonefilter").out.strip(), 'blob:none')
+        self.assertTrue(os.path.isfile(os.path.join(git.cwd, 'b', 'b.txt')))
+
+    def test_sparse(self):
+        git = self._clone('sparse', sparse=['a'])
+        self.assertTrue(os.path.isfile(os.path.join(git.cwd, 'a', 'a.txt')))
+        self.assertTrue(os.path.isfile(os.path.join(git.cwd, 'top.txt')))
+        self.assertFalse(os.path.exists(os.path.join(git.cwd, 'b')))
+
+    def test_clones_share_the_object_cache(self):
+        cache = os.path.join(self.root, 'cache')
+        clones = []
+        for name in ('one', 'two'):
+            reference = gitcmd.update_cache(cache, 'demo', self.url)
+            clones.append(self._clone(name, reference=reference))
+        for git in clones:
+            with open(os.path.join(git.cwd, '.git', 'objects', 'info', 'alternates')) as afile:
+                self.assertEqual(os.path.realpath(afile.read().strip()),
+                                 os.path.realpath(os.path.join(reference, 'objects')))
+            #everything is borrowed, nothing was copied into the clone
+            self.assertEqual(git.run("count-objects", "-v").out.split()[1], '0')
+            self.assertEqual(git.run("fsck", "--connectivity-only", check=False).returncode, 0)
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class RepoPkgCloneTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.env = dict(os.environ)
+        self.work, url = _server(self.root, 'demo')
+        os.environ["GT_REPO_SERVER"] = 'file://'
+        os.environ["GT_REPO_ROOT"] = self.root
+        for name in ('build', 'dev', 'deploy'):
+            os.environ["GT_{}_ROOT".format(name.upper())] = os.path.join(self.root, name)
+        os.environ["GT_CATALOG"] = 'off'
+        os.environ["GT_TIMING"] = 'off'
+        os.makedirs(os.path.join(self.root, 'dev'))
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_fetch_keeps_a_shallow_clone_shallow(self):
+        repo = pkg.RepoPkg(name='demo', depth=1, cache=os.path.join(self.root, 'cache'))
+        self.assertTrue(repo.git.is_shallow())
+        _commit(self.work, 'a/new.txt', 'new')
+        Git(self.work).run("push", "--quiet", "origin", "HEAD")
+        self.assertTrue(repo.fetch_changes(force=True))
+        self.assertTrue(repo.git.is_shallow())
+        self.assertEqual(repo.git.run("rev-list", "--count", "FETCH_HEAD").out.strip(), '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
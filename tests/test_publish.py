@@ -0,0 +1,176 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+try:
+    import pkg
+except ImportError:
+    #needs gtcfg
+    pkg = None
+
+
+class _CfgBatch(object):
+    '''
+    collects the config upserts instead of writing pkg configs
+    '''
+    def __init__(self):
+        self.upserts = []
+
+    def upsert(self, project, data):
+        self.upserts.append((project, data))
+
+    def commit(self):
+        return []
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class CfgPublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        self.env = dict(os.environ)
+        self.live = os.path.join(self.root, 'live')
+        os.makedirs(self.live)
+        for name in ('build', 'dev', 'deploy'):
+            os.environ["GT_{}_ROOT".format(name.upper())] = os.path.join(self.root, name)
+        os.environ[pkg.Pkg._root_map['cfg']] = self.live
+        os.environ["GT_CATALOG"] = 'off'
+        os.environ["GT_TIMING"] = 'off'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _release(self, name, files, release='minor'):
+        src = os.path.join(self.root, 'dev', name)
+        shutil.rmtree(src, ignore_errors=True)
+        os.makedirs(src)
+        for rel, data in files.items():
+            with open(os.path.join(src, rel), 'w') as fobj:
+                fobj.write(data)
+        cfg_pkg = pkg.Pkg(name=name, root='cfg')
+        version = cfg_pkg.deploy_release(release)['tag']['name']
+        cfg_pkg.publish(version, cfg_batch=_CfgBatch())
+        return version
+
+    def _live(self):
+        return sorted(name for name in os.listdir(self.live) if not name.startswith('.'))
+
+    def test_packages_sharing_the_root_keep_their_files(self):
+        self._release('cfga', {'a.yml': 'a'})
+        self._release('cfgb', {'b.yml': 'b'})
+        self.assertEqual(self._live(), ['a.yml', 'b.yml'])
+
+    def test_delta_only_removes_files_of_the_same_package(self):
+        self._release('cfga', {'a.yml': 'a', 'old.yml': 'old'})
+        self._release('cfgb', {'b.yml': 'b'})
+        self._release('cfga', {'a.yml': 'a2', 'new.yml': 'new'}, release='bug')
+        self.assertEqual(self._live(), ['a.yml', 'b.yml', 'new.yml'])
+        with open(os.path.join(self.live, 'a.yml')) as fobj:
+            self.assertEqual(fobj.read(), 'a2')
+
+
+
+class _StoredCfg(object):
+    '''
+    pkg config that is only written to the store on dump, like a cfg file
+    '''
+    store = {}
+    #codes whose dump fails
+    broken = set()
+
+    def __init__(self, id, code, data=None):
+        self.id = id
+        self.code = code
+        self.data = dict(data or {})
+
+    def upsert(self, data):
+        self.data.update(data)
+
+    def dump(self):
+        if self.code in _StoredCfg.broken:
+            raise IOError("can't write {}".format(self.code))
+        _StoredCfg.store[self.code] = (self.id, dict(self.data))
+
+
+class _StoredChain(object):
+
+    def __init__(self, cfg_type, cfg_list):
+        self.cfg_list = cfg_list
+
+    def find_one(self, value):
+        for cfg in self.cfg_list:
+            if cfg.code == value.lower():
+                return cfg
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class CfgBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((name, getattr(pkg.gtcfg.cfg, name))
+                          for name in ('get_configs', 'CfgChain', 'init_cfg'))
+        _StoredCfg.store = {'proj': (1, {'tools': '1.0.0'})}
+        _StoredCfg.broken = set()
+        self.loads = 0
+        pkg.gtcfg.cfg.get_configs = self._get_configs
+        pkg.gtcfg.cfg.CfgChain = _StoredChain
+        pkg.gtcfg.cfg.init_cfg = lambda data: _StoredCfg(data['id'], data['code'])
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(pkg.gtcfg.cfg, name, value)
+
+    def _get_configs(self, cfg_type):
+        self.loads += 1
+        return [_StoredCfg(id, code, data) for code, (id, data) in _StoredCfg.store.items()]
+
+    def test_commit_keeps_edits_made_since_the_load(self):
+        cfg_batch = pkg.PkgCfgBatch(ttl=0)
+        cfg_batch.upsert('proj', {'cfga': '1.1.0'})
+        cfg_batch.upsert('other', {'cfga': '1.1.0'})
+        #someone else publishes to proj meanwhile
+        _StoredCfg.store['proj'][1]['cfgb'] = '2.0.0'
+        self.assertEqual(cfg_batch.commit(), ['other', 'proj'])
+        self.assertEqual(_StoredCfg.store['proj'], (1, {'tools': '1.0.0', 'cfga': '1.1.0', 'cfgb': '2.0.0'}))
+        self.assertEqual(_StoredCfg.store['other'], (2, {'cfga': '1.1.0'}))
+        self.assertEqual(cfg_batch.commit(), [])
+
+    def test_fresh_chain_is_loaded_once(self):
+        cfg_batch = pkg.PkgCfgBatch(ttl=60)
+        cfg_batch.upsert('proj', {'cfga': '1.1.0'})
+        self.assertEqual(cfg_batch.commit(), ['proj'])
+        self.assertEqual(self.loads, 1)
+
+    def test_failed_commit_keeps_the_upserts_not_dumped(self):
+        cfg_batch = pkg.PkgCfgBatch(ttl=60)
+        for project in ('a', 'b', 'c'):
+            cfg_batch.upsert(project, {'cfga': '1.1.0'})
+        _StoredCfg.broken.add('b')
+        self.assertRaises(IOError, cfg_batch.commit)
+        self.assertIn('a', _StoredCfg.store)
+        _StoredCfg.broken.clear()
+        self.assertEqual(cfg_batch.commit(), ['b', 'c'])
+        self.assertEqual(_StoredCfg.store['c'][1], {'cfga': '1.1.0'})
+
+    def test_scopes_commit_only_their_own_upserts(self):
+        cfg_batch = pkg.PkgCfgBatch(ttl=60)
+        first, second = cfg_batch.scope(), cfg_batch.scope()
+        first.upsert('proj', {'cfga': '1.1.0'})
+        second.upsert('other', {'cfgb': '2.0.0'})
+        _StoredCfg.broken.add('other')
+        self.assertRaises(IOError, second.commit)
+        self.assertEqual(first.commit(), ['proj'])
+        self.assertNotIn('other', _StoredCfg.store)
+        _StoredCfg.broken.clear()
+        self.assertEqual(second.commit(), ['other'])
+        self.assertEqual(cfg_batch.commit(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
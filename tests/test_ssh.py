@@ -0,0 +1,84 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import ssh
+from gitcmd import Git
+
+
+class _CountingTransport(ssh._LocalTransport):
+    '''
+    local stand-in for the git server that counts connections and commands
+    '''
+    connects = 0
+    commands = []
+
+    def __init__(self, host, user=None, key_filename=None, password=None):
+        super(_CountingTransport, self).__init__(host, user=user, key_filename=key_filename, password=password)
+        _CountingTransport.connects += 1
+
+    def run(self, command, timeout=None):
+        _CountingTransport.commands.append(command)
+        return super(_CountingTransport, self).run(command, timeout=timeout)
+
+
+class RepoListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        for name in ('one.git', 'two.git', 'notes'):
+            os.mkdir(os.path.join(self.root, name))
+        ssh.close_all()
+        ssh._listings.clear()
+        ssh._backends['counting'] = _CountingTransport
+        _CountingTransport.connects = 0
+        _CountingTransport.commands = []
+
+    def tearDown(self):
+        ssh.close_all()
+        ssh._listings.clear()
+        ssh._backends.pop('counting')
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _list(self, **kw):
+        return ssh.list_repos('git-server', self.root, user='deploy', backend='counting', **kw)
+
+    def test_transports_are_pooled_per_host_and_user(self):
+        first = ssh.transport('git-server', user='deploy', backend='counting')
+        self.assertIs(ssh.transport('git-server', user='deploy', backend='counting'), first)
+        self.assertIsNot(ssh.transport('git-server', user='other', backend='counting'), first)
+        self.assertIsNot(ssh.transport('other-server', user='deploy', backend='counting'), first)
+        self.assertEqual(_CountingTransport.connects, 3)
+
+    def test_listing_is_cached_for_its_ttl(self):
+        self.assertEqual(self._list(), ['one', 'two'])
+        os.mkdir(os.path.join(self.root, 'three.git'))
+        self.assertEqual(self._list(), ['one', 'two'])
+        self.assertEqual(len(_CountingTransport.commands), 1)
+        self.assertEqual(self._list(force=True), ['one', 'three', 'two'])
+        self.assertEqual(self._list(ttl=0), ['one', 'three', 'two'])
+        self.assertEqual(len(_CountingTransport.commands), 3)
+        self.assertEqual(_CountingTransport.connects, 1)
+
+    def test_failed_command_raises(self):
+        self.assertRaises(ssh.SSHError, ssh.list_repos, 'git-server', os.path.join(self.root, 'missing'),
+                          backend='counting')
+
+    def test_repo_exists_through_git(self):
+        work = os.path.join(self.root, 'work')
+        Git().run("init", "--quiet", work)
+        with open(os.path.join(work, 'a.txt'), 'w') as fobj:
+            fobj.write('a')
+        Git(work).run("add", "a.txt")
+        Git(work).run("-c", "user.name=test", "-c", "user.email=test@localhost", "commit", "--quiet", "-m", "a")
+        Git().run("clone", "--quiet", "--bare", work, os.path.join(self.root, 'demo.git'))
+        self.assertTrue(ssh.repo_exists('file://' + os.path.join(self.root, 'demo.git')))
+        self.assertFalse(ssh.repo_exists('file://' + os.path.join(self.root, 'missing.git')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import os
+import sys
+import subprocess
+import unittest
+
+app = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app')
+sys.path.insert(0, app)
+
+try:
+    import pkg
+except ImportError:
+    #needs gtcfg
+    pkg = None
+
+
+@unittest.skipIf(pkg is None, "gtcfg is not installed")
+class StartupTest(unittest.TestCase):
+
+    def test_import_pkg_defers_heavy_modules(self):
+        #the cli imports pkg on every run, these load on first use
+        heavy = ('gitcmd', 'fileops', 'pack', 'alloc', 'subprocess', 'multiprocessing')
+        out = subprocess.Popen([sys.executable, '-c', 'import sys, pkg; print(" ".join(sorted(sys.modules)))'],
+                               cwd=app, stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual([name for name in heavy if name in out.split()], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
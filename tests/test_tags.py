@@ -0,0 +1,117 @@
+import os
+import re
+import sys
+import shutil
+import tempfile
+import unittest
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+import tags
+from tags import TagIndex, TagTable
+
+Tag = collections.namedtuple('Tag', 'name')
+
+
+def _index(root):
+    return TagIndex(root, re.compile(r"^(\d+)\.(\d+)\.(\d+)$"), tags.version_key)
+
+
+class TagIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='deployer_test_')
+        for name in ('1.0.0', '1.2.0', '1.10.0'):
+            os.mkdir(os.path.join(self.root, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _touch_root(self, name):
+        #a new entry in the same second may leave the mtime unchanged
+        stamp = os.stat(self.root).st_mtime + 2
+        os.mkdir(os.path.join(self.root, name))
+        os.utime(self.root, (stamp, stamp))
+
+    def test_warm_cache_does_not_rescan(self):
+        index = _index(self.root)
+        self.assertEqual(index.names(), ['1.0.0', '1.2.0', '1.10.0'])
+        for name, path in index.items():
+            self.assertEqual(index.path(name), path)
+        index.names()
+        self.assertEqual(index.scans, 1)
+
+    def test_changed_root_rescans(self):
+        index = _index(self.root)
+        index.names()
+        self._touch_root('2.0.0')
+        self.assertEqual(index.names()[-1], '2.0.0')
+        self.assertEqual(index.scans, 2)
+
+    def test_add_keeps_tags_of_other_processes(self):
+        index = _index(self.root)
+        index.names()
+        #another process creates 1.11.0 while we create 1.12.0
+        self._touch_root('1.11.0')
+        self._touch_root('1.12.0')
+        index.add('1.12.0', 'abc')
+        self.assertEqual(index.names(), ['1.0.0', '1.2.0', '1.10.0', '1.11.0', '1.12.0'])
+        self.assertEqual(index.get_commit('1.12.0'), 'abc')
+
+    def test_add_rescans_once(self):
+        index = _index(self.root)
+        index.names()
+        self._touch_root('1.11.0')
+        index.add('1.11.0')
+        self.assertEqual(index.names()[-1], '1.11.0')
+        index.names()
+        self.assertEqual(index.scans, 2)
+
+
+
+class TagTableTest(unittest.TestCase):
+
+    def _table(self, names, builds=False):
+        return TagTable([Tag(name) for name in names], builds=builds)
+
+    def test_order_is_numeric(self):
+        builds = self._table(['rc10', 'rc9', 'rc100'], builds=True)
+        self.assertEqual([tag.name for tag in builds], ['rc9', 'rc10', 'rc100'])
+        self.assertEqual(builds.latest().name, 'rc100')
+        self.assertEqual(builds.next(), 'rc101')
+        versions = self._table(['1.10.0', '1.9.0', '1.9.10', '1.9.2'])
+        self.assertEqual([tag.name for tag in versions], ['1.9.0', '1.9.2', '1.9.10', '1.10.0'])
+        self.assertEqual(versions.next('minor'), '1.11.0')
+        self.assertEqual(versions.next('bug'), '1.10.1')
+        self.assertEqual(versions.next('major'), '2.0.0')
+
+    def test_next_of_an_empty_table(self):
+        self.assertEqual(self._table([], builds=True).next(), 'rc1')
+        self.assertEqual(self._table([]).next('minor'), '1.1.0')
+        self.assertEqual(self._table([]).next('bug', default='2.3.4'), '2.3.5')
+
+    def test_range_bounds(self):
+        versions = self._table(['1.9.0', '1.10.0', '2.0.0', '2.0.1', '3.0.0'])
+        names = lambda spec: [tag.name for tag in versions.range(spec)]
+        self.assertEqual(names('>=1.10,<3'), ['1.10.0', '2.0.0', '2.0.1'])
+        self.assertEqual(names('>2.0.0'), ['2.0.1', '3.0.0'])
+        self.assertEqual(names('<=2.0.0'), ['1.9.0', '1.10.0', '2.0.0'])
+        self.assertEqual(names('2.0.*'), ['2.0.0', '2.0.1'])
+        self.assertEqual(names('==1.10.0'), ['1.10.0'])
+        self.assertEqual(names('>=4'), [])
+        self.assertEqual(len(versions.range('*')), 5)
+        builds = self._table(['rc1', 'rc9', 'rc10', 'rc11'], builds=True)
+        self.assertEqual([tag.name for tag in builds.range('>rc9,<=rc10')], ['rc10'])
+        self.assertRaises(ValueError, versions.range, '~1.0')
+
+    def test_find(self):
+        versions = self._table(['1.9.0', '1.10.0'])
+        self.assertEqual(versions.find('1.10.0').name, '1.10.0')
+        self.assertEqual(versions.find('1.10'), versions.find('1.10.0'))
+        self.assertIsNone(versions.find('1.11.0'))
+        self.assertIsNone(self._table([], builds=True).find('rc1'))
+
+
+if __name__ == '__main__':
+    unittest.main()